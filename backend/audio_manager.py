@@ -4,11 +4,12 @@ Audio Manager - Sound loading and playback
 
 import pygame
 import os
-from functools import lru_cache
-from config import CHANNELS, LOW_FIRE, HIGH_FIRE, MED_FIRE
-
-# Magic Numbers
+import functools
+import logging
+from collections import namedtuple
+from config import CHANNELS, SOUND_RULES, LOW_FIRE, HIGH_FIRE, MED_FIRE, Target
 
+log = logging.getLogger(__name__)
 
 # ============================================================================
 # PLAYBACK STATE
@@ -21,121 +22,196 @@ playing_state = {
     'mixing_bowl': False
 }
 
+# ============================================================================
+# SENSOR FRAME
+# ============================================================================
+
+# One parsed MQTT packet; fields are plain attribute loads in the hot path.
+# buttons holds the cutting board pad bitmask (bit i = pad i).
+SensorFrame = namedtuple("SensorFrame", "rotation distance x y direction buttons")
+
+
+def sensor_frame(data, direction=None):
+    """
+    Build a SensorFrame from the 'data' dict of an MQTT payload.
+    
+    Args:
+        data: dict of sensor values from MQTT
+        direction: mixing bowl direction detected by the MQTT handler
+    """
+    return SensorFrame(
+        data.get('rotation', 0),
+        data.get('distance', False),
+        data.get('x', BOWL_CENTER),
+        data.get('y', BOWL_CENTER),
+        direction,
+        data.get('pads', 0),
+    )
+
+
 # ============================================================================
 # SOUND CONDITION CHECKING
 # ============================================================================
 
-def should_play(utensil, sensor_data, target, threshold):
+# Mixing bowl joystick geometry
+BOWL_CENTER = 512
+BOWL_EDGE_THRESHOLD = 256  # dist from the center
+
+# Looked up once per rule by compile_rule
+# Pan: target -> rotation the stove knob must be near
+_PAN_RULES = {
+    Target.LOW: LOW_FIRE,
+    Target.MED: MED_FIRE,
+    Target.HIGH: HIGH_FIRE,
+}
+
+# Mixing bowl: target -> (sensor axis, side of center the stick must be on)
+_BOWL_RULES = {
+    Target.UP: ("y", -1),     # y close to 0
+    Target.DOWN: ("y", +1),   # y close to 1023
+    Target.LEFT: ("x", -1),   # x close to 0
+    Target.RIGHT: ("x", +1),  # x close to 1023
+}
+
+
+
+def _never(sensor_data):
+    return False
+
+
+def _compile_pan(target, threshold):
+    # Pan uses rotation sensor for heat, proximity "button" for flips
+    center = _PAN_RULES.get(target)
+    if center is not None:
+        lo, hi = center - threshold, center + threshold
+        return lambda sensor_data: lo <= sensor_data.rotation <= hi
+    if target == Target.FLIP:
+        return lambda sensor_data: sensor_data.distance
+    return _never
+
+
+def _compile_cutting_board(target, threshold):
+    # Cutting board uses button presses (target is BUTTON_BASE + pad ID)
+    pad = target - Target.BUTTON_BASE
+    if pad < 0:
+        return _never
+    bit = 1 << pad
+    return lambda sensor_data: bool(sensor_data.buttons & bit)
+
+
+def _compile_mixing_bowl(target, threshold):
+    # Mixing Bowl: up down right left
+    rule = _BOWL_RULES.get(target)
+    if rule is None:
+        return _never
+    axis, side = rule
+    if axis == "x":
+        return lambda sensor_data: (sensor_data.x - BOWL_CENTER) * side > BOWL_EDGE_THRESHOLD
+    return lambda sensor_data: (sensor_data.y - BOWL_CENTER) * side > BOWL_EDGE_THRESHOLD
+
+
+# Utensil -> builder for its condition checks (one hashed dispatch)
+_RULE_COMPILERS = {
+    'pan': _compile_pan,
+    'cutting_board': _compile_cutting_board,
+    'mixing_bowl': _compile_mixing_bowl,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_rule(utensil, target, threshold):
     """
-    Check if the current sensor data meets the target condition for this utensil.
+    Build the condition check for one utensil/target/threshold as a closure,
+    so the per-message call does no dispatch or table lookups. Cached: a
+    chart only uses a handful of combinations.
     
     Args:
         utensil: 'pan', 'cutting_board', or 'mixing_bowl'
-        sensor_data: dict of sensor values from MQTT
-        target: the target value from the chart (e.g., "low", "high", button ID)
+        target: Target code from the chart (e.g., Target.LOW, Target.BUTTON_BASE + pad)
         threshold: numeric threshold for comparison
     
     Returns:
-        bool: True if condition is met, False otherwise
+        callable: predicate(sensor_data) -> truthy if the condition is met
     """
-    
-    if target is None:
-        return False
+    compiler = _RULE_COMPILERS.get(utensil)
+    if compiler is None or target is None:
+        return _never
+    return compiler(target, threshold)
 
-    if utensil == 'pan':
-        # Pan uses rotation sensor AND button state (on/off)
-        button_held = sensor_data.get('distance', False)
-        
-        # # Determine stove state based on target
-        # if "off" in str(target):
-        #     stove_on = (button_held == False)  # OFF means button NOT held
-        # elif "on" in str(target):
-        #     stove_on = (button_held == True)   # ON means button held
-        # else:
-        #     stove_on = True  # Legacy: assume stove is on
-        
-        # Then check rotation threshold
-        curr_val = sensor_data.get('rotation', 0)
-        if "low" in str(target):
-            return curr_val <= LOW_FIRE + threshold and curr_val >= LOW_FIRE - threshold 
-        elif "med" in str(target):
-            return curr_val <= MED_FIRE + threshold and curr_val >= MED_FIRE - threshold 
-        elif "high" in str(target):
-            return curr_val <= HIGH_FIRE + threshold and curr_val >= HIGH_FIRE - threshold 
-        elif "flip" in str(target):
-            return button_held 
-        
-        return False
 
-        
-        
-    elif utensil == "cutting_board":
-        # Cutting board uses button presses
-        button_id = str(target)
-        return sensor_data.get(button_id, 0) == 1
+def should_play(utensil, sensor_data, target, threshold):
+    """
+    Check if the current sensor data meets the target condition for this utensil.
     
-    elif utensil == "mixing_bowl":
-        # Mixing Bowl: up down right left
-        x = sensor_data.get('x', 512)  # center
-        y = sensor_data.get('y', 512)
-        
-        # threshold
-        EDGE_THRESHOLD = 256  # dist from the center
-        CENTER = 512
-        
-        if target == "up":
-            # up: y = close to 0
-            return y < (CENTER - EDGE_THRESHOLD)
-        
-        elif target == "down":
-            # down: y = close to 1023
-            return y > (CENTER + EDGE_THRESHOLD)
-        
-        elif target == "left":
-            # left: x close to 0
-            return x < (CENTER - EDGE_THRESHOLD)
-        
-        elif target == "right":
-            # right: x close to 1023
-            return x > (CENTER + EDGE_THRESHOLD)
-        
-        # elif target == "low":
-        #     return sensor_data.get('speed', 0) < 400
-        # elif target == "high":
-        #     return sensor_data.get('speed', 0) > 400
+    Args:
+        utensil: 'pan', 'cutting_board', or 'mixing_bowl'
+        sensor_data: SensorFrame built from the MQTT payload
+        target: Target code from the chart (e.g., Target.LOW, Target.BUTTON_BASE + pad)
+        threshold: numeric threshold for comparison
     
-    return False
+    Returns:
+        bool: True if condition is met, False otherwise
+    """
+    return compile_rule(utensil, target, threshold)(sensor_data)
 
 
 # ============================================================================
 # AUDIO PLAYBACK
 # ============================================================================
 
-@lru_cache(maxsize=10)
+# Decoded sound objects by file path (never evicted)
+_SOUND_CACHE = {}
+
+
 def load_sound(file_path):
-    """Cache loaded sound objects to avoid reloading."""
+    """Return the cached sound object, decoding the file on first use."""
+    sound = _SOUND_CACHE.get(file_path)
+    if sound is not None:
+        return sound
     if not os.path.exists(file_path):
-        print(f"[ERROR] File not found: {file_path}")
+        log.error("[ERROR] File not found: %s", file_path)
         return None
     try:
-        return pygame.mixer.Sound(file_path)
+        sound = pygame.mixer.Sound(file_path)
     except pygame.error as e:
-        print(f"[ERROR] Cannot load sound file: {e}")
+        log.error("[ERROR] Cannot load sound file: %s", e)
         return None
+    _SOUND_CACHE[file_path] = sound
+    return sound
+
 
+def preload_sounds(chart_data):
+    """
+    Decode every sound the chart can trigger so the first play has no load
+    delay, and keep the Sound object on the rule for play_sound.
+    """
+    utensils = {evt["utensil"] for evt in chart_data["events"]}
+    for utensil in utensils:
+        rule = SOUND_RULES.get(utensil)
+        if rule and rule.sound is None:
+            SOUND_RULES[utensil] = rule._replace(sound=load_sound(rule.file))
 
-def play_sound(utensil, file_path, loop=False):
-    """Play a sound for a specific utensil on its dedicated channel."""
-    sound = load_sound(file_path)
+
+def play_sound(utensil, rule, loop=False):
+    """
+    Play a utensil's rule sound on its dedicated channel, unless it is still playing.
+    
+    Returns:
+        True if playback started, False if skipped (no sound, no channel, or busy)
+    """
+    sound = rule.sound or load_sound(rule.file)  # Not preloaded: use the cache
     if not sound:
-        return
+        return False
 
     channel = CHANNELS.get(utensil)
-    if channel:
-        channel.play(sound, loops=-1 if loop else 0)
-        print(f"[PLAYING] {utensil}: {file_path}")
-    else:
-        print(f"[WARN] No channel for utensil '{utensil}'")
+    if not channel:
+        log.warning("[WARN] No channel for utensil '%s'", utensil)
+        return False
+    if channel.get_busy():  # e.g. a one-shot still ringing out
+        return False
+    channel.play(sound, loops=-1 if loop else 0)
+    log.debug("[PLAYING] %s: %s", utensil, rule.file)
+    return True
 
 
 def stop_sound(utensil):
@@ -143,7 +219,7 @@ def stop_sound(utensil):
     channel = CHANNELS.get(utensil)
     if channel:
         channel.stop()
-        print(f"[STOPPED] {utensil}")
+        log.debug("[STOPPED] %s", utensil)
 
 
 def close_audio():
@@ -4,11 +4,17 @@ Chart Manager - Rhythm chart playback and scheduling
 
 import time
 import threading
+import logging
 import heapq
 import itertools
+from operator import itemgetter
 
-from config import LEAD_TIME, SOUND_RULES, HOLD_THRESHOLD
-from game_logic import pending_notes, pending_lock, sound_rules_lock, note_miss_checker
+from config import LEAD_TIME, SOUND_RULES, HOLD_THRESHOLD, MONOTONIC_TO_WALL, target_code
+from game_logic import (pending_notes, pending_locks,
+                        note_miss_checker, raise_thread_priority)
+from audio_manager import preload_sounds, compile_rule
+
+log = logging.getLogger(__name__)
 
 # ============================================================================
 # CHART PLAYBACK STATE
@@ -16,11 +22,18 @@ from game_logic import pending_notes, pending_lock, sound_rules_lock, note_miss_
 
 counter = itertools.count()  # unique ID generator for heap queue
 
+# Event kinds in the playback queue (visual sorts first at equal times)
+VISUAL = 0
+ACTIVATE = 1
+
 chart_data = None
 chart_thread = None
 chart_playing = False
 miss_checker_thread = None
 
+# Set to wake the playback threads immediately when the chart stops
+stop_event = threading.Event()
+
 
 # ============================================================================
 # CHART PLAYBACK CONTROL
@@ -46,7 +59,11 @@ def start_chart_playback(socketio, loaded_chart_data):
         print("[WARN] Chart already running.")
         return
 
+    # Decode sounds up front so the first hit doesn't stall on file loading
+    preload_sounds(chart_data)
+
     chart_playing = True
+    stop_event.clear()
     
     # Start chart playback thread
     chart_thread = threading.Thread(target=_chart_loop, args=(socketio,), daemon=True)
@@ -55,7 +72,7 @@ def start_chart_playback(socketio, loaded_chart_data):
     # Start miss detection thread
     miss_checker_thread = threading.Thread(
         target=note_miss_checker, 
-        args=(socketio, lambda: chart_playing), 
+        args=(socketio, lambda: chart_playing, stop_event), 
         daemon=True
     )
     miss_checker_thread.start()
@@ -65,6 +82,7 @@ def stop_chart_playback():
     """Stop an in-progress chart."""
     global chart_playing
     chart_playing = False
+    stop_event.set()
     print("[CHART] Stop requested")
 
 
@@ -89,6 +107,7 @@ def restart_chart_playback(socketio, loaded_chart_data):
     
     # Stop current chart playback
     chart_playing = False
+    stop_event.set()
     
     # Wait for threads to finish
     if chart_thread and chart_thread.is_alive():
@@ -100,15 +119,15 @@ def restart_chart_playback(socketio, loaded_chart_data):
         print("[RESTART] Miss checker thread stopped")
     
     # Clear all pending notes
-    with pending_lock:
-        pending_notes.clear()
-        print("[RESTART] Cleared pending notes")
+    for utensil, bucket in pending_notes.items():
+        with pending_locks[utensil]:
+            bucket.clear()
+    print("[RESTART] Cleared pending notes")
     
     # Reset sound rules to default target values
-    with sound_rules_lock:
-        for utensil in SOUND_RULES:
-            SOUND_RULES[utensil]["target_value"] = None
-        print("[RESTART] Reset sound rules")
+    for utensil, rule in SOUND_RULES.items():
+        SOUND_RULES[utensil] = rule._replace(target_value=None, check=None)
+    print("[RESTART] Reset sound rules")
     
     # Small delay to ensure clean state
     time.sleep(0.1)
@@ -120,10 +139,10 @@ def restart_chart_playback(socketio, loaded_chart_data):
 
 def _chart_loop(socketio):
     """
-    Main chart playback loop. Manages two priority queues:
+    Main chart playback loop. Manages one priority queue of two event kinds:
     
-    1. Visual Queue: Sends notes to frontend LEAD_TIME seconds early
-    2. Activation Queue: Activates target values at the exact beat time
+    1. Visual events: Send notes to frontend LEAD_TIME seconds early
+    2. Activation events: Activate target values at the exact beat time
     
     Timeline for a note at beat 5.0 seconds:
     - t=2.0s: Visual event sent to frontend (note appears on screen)
@@ -132,6 +151,8 @@ def _chart_loop(socketio):
     - t=5.15s+: Miss if not hit
     """
     global chart_playing
+
+    raise_thread_priority("CHART")
     
     # 3-2-1 countdown before chart starts
     print("[COUNTDOWN] Starting countdown...")
@@ -155,84 +176,117 @@ def _chart_loop(socketio):
 
     events = chart_data["events"]
     manual_offset = chart_data.get("offset", 0)
-    start_time = time.time() + manual_offset
-
-    # Two priority queues for scheduling events
-    visual_queue = []      # (visual_time, unique_id, event)
-    activation_queue = []  # (activation_time, unique_id, event)
-
-    # Build both queues and populate pending notes
-    with pending_lock:
-        for evt in events:
-            hit_time = start_time + float(evt["time"])
-            visual_time = hit_time - LEAD_TIME
-            
-            # Add to visual queue (shows note on screen early)
-            heapq.heappush(visual_queue, (visual_time, next(counter), evt))
-            
-            # Add to activation queue (activates target at exact time)
-            heapq.heappush(activation_queue, (hit_time, next(counter), evt))
+    start_time = time.monotonic() + manual_offset
+
+    # One priority queue for scheduling events
+    event_queue = []  # (time, kind, unique_id, event)
+
+    # Build both queues and collect pending notes per utensil
+    new_notes = {utensil: [] for utensil in pending_notes}
+    for evt in events:
+        # Only utensils with a pending-notes bucket can be judged or activated
+        bucket = new_notes.get(evt["utensil"])
+        if bucket is None:
+            log.warning("[CHART] Skipping event for unknown utensil %r at %ss",
+                        evt["utensil"], evt["time"])
+            continue
+
+        # Charts saved before target codes existed only carry the string
+        if "target_code" not in evt:
+            evt["target_code"] = target_code(evt["target"])
+
+        hit_time = start_time + float(evt["time"])
+        visual_time = hit_time - LEAD_TIME
+        
+        # Visual event (shows note on screen early)
+        heapq.heappush(event_queue, (visual_time, VISUAL, next(counter), evt))
+        
+        # Activation event (activates target at exact time)
+        heapq.heappush(event_queue, (hit_time, ACTIVATE, next(counter), evt))
+
+        # Track as pending note for hit detection
+        duration = evt.get("duration", 0)  # 0 means tap note
+        bucket.append({
+            "utensil": evt["utensil"],
+            "instrument": evt["instrument"],
+            "target": evt["target"],
+            "target_code": evt["target_code"],
+            "hit_time": hit_time,
+            "duration": duration,
+            "is_hold": duration > HOLD_THRESHOLD,
+            "hit": False,
+            "hold_started": False,
+            "hold_active": False,
+            "hold_broken": False,
+            "hold_end_time": hit_time + duration,
+            "last_check_time": None
+        })
 
-            # Track as pending note for hit detection
-            duration = evt.get("duration", 0)  # 0 means tap note
-            pending_notes.append({
-                "utensil": evt["utensil"],
-                "instrument": evt["instrument"],
-                "target": evt["target"],
-                "hit_time": hit_time,
-                "duration": duration,
-                "is_hold": duration > HOLD_THRESHOLD,
-                "hit": False,
-                "hold_started": False,
-                "hold_active": False,
-                "hold_broken": False,
-                "hold_end_time": hit_time + duration,
-                "last_check_time": None
-            })
+    # Publish each utensil's notes under that utensil's lock only. Buckets
+    # must be in hit_time order (hit and miss scans stop at the first note
+    # still in its window), and a chart file need not be
+    for utensil, notes in new_notes.items():
+        notes.sort(key=itemgetter("hit_time"))
+        with pending_locks[utensil]:
+            pending_notes[utensil].extend(notes)
 
     print(f"[CHART] Playback started - {len(events)} events loaded")
 
     # Main playback loop
-    while chart_playing and (visual_queue or activation_queue):
-        now = time.time()
+    while chart_playing and event_queue:
+        now = time.monotonic()
+        batch_visual = []  # chart_event payloads due this tick
+        batch_active = []  # target_active payloads due this tick
+
+        # Process all events that are due now
+        while event_queue and event_queue[0][0] <= now:
+            _, kind, _, evt = heapq.heappop(event_queue)
+
+            if kind == ACTIVATE:
+                # Set target value in sound rules (backend starts listening);
+                # one dict assignment, so MQTT readers see old or new, never half
+                # (with its condition compiled here, not per MQTT message)
+                u = evt["utensil"]
+                rule = SOUND_RULES[u]
+                SOUND_RULES[u] = rule._replace(
+                    target_value=evt["target_code"],
+                    check=compile_rule(u, evt["target_code"], rule.threshold))
+
+                # Queue notice to frontend that target is now active
+                batch_active.append({
+                    "utensil": evt["utensil"],
+                    "instrument": evt["instrument"],
+                    "target": evt["target"],
+                    "event_time": now + MONOTONIC_TO_WALL
+                })
+
+                log.debug("[ACTIVE] %s = %s", evt['utensil'], evt['target'])
+                continue
 
-        # Process all visual events that should be shown now
-        while visual_queue and visual_queue[0][0] <= now:
-            _, _, evt = heapq.heappop(visual_queue)
             hit_time = start_time + evt["time"]
 
-            # Send to frontend for visual display
-            socketio.emit("chart_event", {
+            # Queue for frontend visual display
+            batch_visual.append({
                 "instrument": evt["instrument"],
                 "utensil": evt["utensil"],
                 "target": evt["target"],
-                "event_time": hit_time,
-                "server_time": now,
+                "event_time": hit_time + MONOTONIC_TO_WALL,
+                "server_time": now + MONOTONIC_TO_WALL,
                 "duration": evt.get("duration", 0),
                 "is_hold": evt.get("duration", 0) > HOLD_THRESHOLD
             })
             
-            print(f"[VISUAL] {evt['utensil']} (target={evt['target']})")
-
-        # Process all activation events that should be active now
-        while activation_queue and activation_queue[0][0] <= now:
-            _, _, evt = heapq.heappop(activation_queue)
-
-            # Set target value in sound rules (backend starts listening)
-            with sound_rules_lock:
-                SOUND_RULES[evt["utensil"]]["target_value"] = evt["target"]
-
-            # Inform frontend that target is now active
-            socketio.emit("target_active", {
-                "utensil": evt["utensil"],
-                "instrument": evt["instrument"],
-                "target": evt["target"],
-                "event_time": now
-            })
-
-            print(f"[ACTIVE] {evt['utensil']} = {evt['target']}")
+            log.debug("[VISUAL] %s (target=%s)", evt['utensil'], evt['target'])
         
-        time.sleep(0.01)  # 10ms tick
+        # At most one frame per event type per tick
+        if batch_visual:
+            socketio.emit("chart_events", batch_visual)
+        if batch_active:
+            socketio.emit("target_actives", batch_active)
+
+        # Sleep until the next scheduled event instead of a fixed tick
+        if event_queue:
+            stop_event.wait(max(0.001, event_queue[0][0] - time.monotonic()))
 
     chart_playing = False
     print("[CHART] Playback finished")
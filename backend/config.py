@@ -3,6 +3,9 @@ Configuration and Constants
 """
 
 import pygame
+import time
+from enum import IntEnum
+from collections import namedtuple
 
 # ============================================================================
 # TIMING CONSTANTS
@@ -13,6 +16,55 @@ HIT_WINDOW = 0.5  # ±150ms window for hitting notes
 HOLD_CHECK_INTERVAL = 0.05  # check hold status every 50ms
 HOLD_GRACE_PERIOD = 0.1  # 100ms grace before breaking a hold
 HOLD_THRESHOLD = 1
+MISS_CHECK_IDLE = 0.1  # miss checker re-check interval while no notes are pending
+EMIT_BATCH_INTERVAL = 0.02  # MQTT debug messages are sent to browsers in 20ms batches
+
+# SCHED_FIFO priority for the chart and miss-checker threads (needs CAP_SYS_NICE or root;
+# not applied under eventlet, where those threads are greenlets on the main OS thread)
+RT_PRIORITY = 10
+
+# Scheduling runs on time.monotonic(); add this to get wall-clock times for the frontend
+MONOTONIC_TO_WALL = time.time() - time.monotonic()
+
+# ============================================================================
+# CHART TARGETS
+# ============================================================================
+
+class Target(IntEnum):
+    """Integer codes for chart targets, compared instead of strings in the hit path."""
+    LOW = 0
+    MED = 1
+    HIGH = 2
+    FLIP = 3
+    UP = 4
+    DOWN = 5
+    LEFT = 6
+    RIGHT = 7
+    CLOCKWISE = 8
+    COUNTERCLOCKWISE = 9
+    BUTTON_BASE = 100  # cutting board pad N is BUTTON_BASE + N
+
+
+def target_code(target):
+    """
+    Translate a chart target string to its Target code.
+    
+    Args:
+        target: target string from the chart (e.g., "low", "up", or a pad ID like "0");
+            older charts may store pad IDs as ints
+    
+    Returns:
+        int code, or None if the target is missing or unknown
+    """
+    if target is None:
+        return None
+    target = str(target)
+    if target.isdigit():
+        return Target.BUTTON_BASE + int(target)
+    member = Target.__members__.get(target.upper())
+    if member is None or member is Target.BUTTON_BASE:
+        return None
+    return member
 
 # ============================================================================
 # MQTT CONFIGURATION
@@ -23,6 +75,14 @@ MQTT_PORT = 1883
 MQTT_TOPIC = 'IDD/kitchen-instrument'
 MQTT_USERNAME = 'idd'
 MQTT_PASSWORD = 'device@theFarm'
+MQTT_SESSION_EXPIRY = 3600  # seconds the broker keeps our subscription across disconnects
+
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+# Per-note game events log at DEBUG; set to 'DEBUG' to see them
+LOG_LEVEL = 'WARNING'
 
 # ============================================================================
 # MESSAGE STORAGE
@@ -34,36 +94,61 @@ MAX_MESSAGES = 100  # Maximum messages to store in history
 # AUDIO CONFIGURATION
 # ============================================================================
 
-# Initialize pygame mixer once
+AUDIO_FREQUENCY = 44100
+AUDIO_SIZE = -16  # signed 16-bit samples
+AUDIO_CHANNELS = 2  # stereo
+AUDIO_BUFFER = 1024  # ~23ms at 44.1kHz; smaller underruns under MQTT load, larger adds latency
+NUM_MIXER_CHANNELS = 8  # utensils + music + headroom for overlapping one-shots
+
+# Initialize pygame mixer once (pre_init must come before init to take effect)
+pygame.mixer.pre_init(AUDIO_FREQUENCY, AUDIO_SIZE, AUDIO_CHANNELS, AUDIO_BUFFER)
 pygame.mixer.init()
+pygame.mixer.set_num_channels(NUM_MIXER_CHANNELS)
 print("[OK] Audio system ready")
 
 # Dedicated audio channels for each utensil (prevents interference)
 CHANNELS = {
     'pan': pygame.mixer.Channel(0),
     'cutting_board': pygame.mixer.Channel(1),
-    'mixing_bowl': pygame.mixer.Channel(2)
+    'mixing_bowl': pygame.mixer.Channel(2),
+    'music': pygame.mixer.Channel(3)
 }
 
+# Keep auto-allocated Sound.play() calls off the dedicated channels
+pygame.mixer.set_reserved(len(CHANNELS))
+
+# Sound rule for one utensil. Immutable: the chart loop publishes a new Rule
+# (via _replace) in a single dict assignment, so readers need no lock.
+# sound holds the decoded pygame Sound once preload_sounds() has run;
+# check is the compiled condition for target_value (audio_manager.compile_rule)
+Rule = namedtuple("Rule", "file threshold target_value sound check", defaults=(None, None))
+
 # Sound configuration for each utensil
 SOUND_RULES = {
-    'pan': {
-        'file': 'sounds/pan_sizzle.mp3',
-        'threshold': 2,
-        'target_value': None  # Will be set by chart (e.g., "low" or "high")
-    },
-    'cutting_board': {
-        'file': 'sounds/knife-stab-pull.mp3',
-        'threshold': 0,
-        'target_value': None  # Will be set by chart (e.g., button ID)
-    },
-    'mixing_bowl': {
-        'file': 'sounds/whisking.mp3',
-        'threshold': 0,
-        'target_value': None  # Will be set by chart (e.g., acceleration value)
-    }
+    'pan': Rule(
+        file='sounds/pan_sizzle.mp3',
+        threshold=2,
+        target_value=None  # Will be set by chart (Target code, e.g., Target.LOW)
+    ),
+    'cutting_board': Rule(
+        file='sounds/knife-stab-pull.mp3',
+        threshold=0,
+        target_value=None  # Will be set by chart (Target.BUTTON_BASE + pad ID)
+    ),
+    'mixing_bowl': Rule(
+        file='sounds/whisking.mp3',
+        threshold=0,
+        target_value=None  # Will be set by chart (e.g., acceleration value)
+    )
 }
 
+# Thresholds never change after startup
+THRESHOLDS = {utensil: rule.threshold for utensil, rule in SOUND_RULES.items()}
+
+# Consecutive non-matching readings before a playing sound is stopped, so a
+# single jittery sample doesn't cut (and then restart) it
+SOUND_STOP_SAMPLES = 3
+
 # Pan Fire Values
 LOW_FIRE = 5
 MED_FIRE = 10
@@ -2,47 +2,66 @@
 Game Logic - Note hit detection and scoring
 """
 
+import os
 import time
 import threading
-from config import HIT_WINDOW, HOLD_CHECK_INTERVAL, HOLD_GRACE_PERIOD, SOUND_RULES
+import logging
+from collections import deque
+from config import (HIT_WINDOW, HOLD_CHECK_INTERVAL, HOLD_GRACE_PERIOD,
+                    MISS_CHECK_IDLE, MONOTONIC_TO_WALL, RT_PRIORITY, THRESHOLDS)
 from audio_manager import should_play
 
+log = logging.getLogger(__name__)
+
 # ============================================================================
 # GAME STATE
 # ============================================================================
 
-# Thread-safe note tracking
-pending_notes = []
-pending_lock = threading.Lock()
-
-# Thread-safe sound rules
-sound_rules_lock = threading.Lock()
+# Thread-safe note tracking, bucketed by utensil so a sensor packet only
+# scans the notes for the utensil that sent it. Each bucket is sorted by
+# hit_time; finished notes are popped from the front, and notes finished
+# out of order stay behind as tombstones (their flags make the scans skip them)
+pending_notes = {
+    'pan': deque(),
+    'cutting_board': deque(),
+    'mixing_bowl': deque()
+}
+# One lock per bucket so different utensils never contend with each other
+pending_locks = {utensil: threading.Lock() for utensil in pending_notes}
 
 
 # ============================================================================
 # NOTE HIT DETECTION
 # ============================================================================
 
-def check_note_hits(utensil, sensor_data, socketio):
+def _is_done(note, now):
+    """True once a note no longer needs to stay in its pending bucket."""
+    if note["is_hold"]:
+        # Hold notes that are complete or broken
+        return note["hit"] or note["hold_broken"]
+    # Tap notes that are judged or past window
+    return note["hit"] or now > note["hit_time"] + HIT_WINDOW
+
+
+def _judge_notes(utensil, notes, sensor_data, threshold, now, lock):
     """
-    Check if current sensor data hits any pending notes for this utensil.
-    Handles both tap notes and hold notes.
+    Judge one sensor reading against a snapshot of pending notes.
+    Marks judged notes in place (under lock) and returns the note_result
+    payloads; the caller decides how to send them.
     
     Args:
         utensil: The utensil that sent the data
-        sensor_data: Dictionary of sensor values
-        socketio: SocketIO instance for emitting events
+        notes: Snapshot list of this utensil's pending notes
+        sensor_data: SensorFrame parsed from the MQTT payload
+        threshold: Sound rule threshold for this utensil
+        now: Time of the reading
+        lock: The bucket lock guarding note state
     """
-    now = time.time()
-
-    # Get thread-safe copy of pending notes
-    with pending_lock:
-        notes_copy = list(pending_notes)
+    results = []
+    matches = {}  # target code -> should_play result; constant for one reading
 
     # Check each pending note for this utensil
-    for note in notes_copy:
-        if note["utensil"] != utensil:  # Wrong instrument
-            continue
+    for note in notes:
         if note["hit"] and not note["is_hold"]:  # Tap note already judged
             continue
         if note.get("hold_broken"):  # Hold note already failed
@@ -60,42 +79,44 @@ def check_note_hits(utensil, sensor_data, socketio):
                 continue
 
             # Within hit window - check if sensor condition is met
-            with sound_rules_lock:
-                rule = SOUND_RULES[utensil]
-                if should_play(utensil, sensor_data, note["target"], rule['threshold']):
-                    # SUCCESS! Mark as hit
-                    with pending_lock:
-                        for n in pending_notes:
-                            if (n["utensil"] == note["utensil"] and 
-                                n["hit_time"] == note["hit_time"] and 
-                                not n["hit"]):
-                                n["hit"] = True
-                                break
-
-                    # Send hit result to frontend
-                    socketio.emit("note_result", {
-                        "utensil": utensil,
-                        "instrument": note["instrument"],
-                        "result": "hit",
-                        "note_type": "tap",
-                        "time": now,
-                        "scheduled": note["hit_time"],
-                        "accuracy_ms": int(dt * 1000)
-                    })
-                    # Debug: show what direction triggered the hit
-                    if utensil == "mixing_bowl":
-                        direction = sensor_data.get('direction', 'None')
-                        print(f"[TAP HIT] {utensil} target={note['target']} detected_direction={direction} accuracy {int(dt*1000)}ms")
-                    else:
-                        print(f"[TAP HIT] {utensil} accuracy {int(dt*1000)}ms")
+            code = note["target_code"]
+            condition_met = matches.get(code)
+            if condition_met is None:
+                condition_met = matches[code] = should_play(utensil, sensor_data, code, threshold)
+
+            if condition_met:
+                # SUCCESS! Mark as hit (the snapshot shares the note dicts)
+                with lock:
+                    if note["hit"]:  # Judged as a miss in the meantime
+                        continue
+                    note["hit"] = True
+
+                # Send hit result to frontend
+                results.append({
+                    "utensil": utensil,
+                    "instrument": note["instrument"],
+                    "result": "hit",
+                    "note_type": "tap",
+                    "time": now + MONOTONIC_TO_WALL,
+                    "scheduled": note["hit_time"] + MONOTONIC_TO_WALL,
+                    "accuracy_ms": int(dt * 1000)
+                })
+                # Debug: show what direction triggered the hit
+                if utensil == "mixing_bowl":
+                    direction = sensor_data.direction
+                    log.debug("[TAP HIT] %s target=%s detected_direction=%s accuracy %dms",
+                              utensil, note['target'], direction, dt * 1000)
+                else:
+                    log.debug("[TAP HIT] %s accuracy %dms", utensil, dt * 1000)
 
         # ==============================================================
         # HOLD NOTE LOGIC (duration > 0)
         # ==============================================================
         else:
-            with sound_rules_lock:
-                rule = SOUND_RULES[utensil]
-                condition_met = should_play(utensil, sensor_data, note["target"], rule['threshold'])
+            code = note["target_code"]
+            condition_met = matches.get(code)
+            if condition_met is None:
+                condition_met = matches[code] = should_play(utensil, sensor_data, code, threshold)
 
             # PHASE 1: Starting the hold (within hit window of start time)
             if not note["hold_started"]:
@@ -104,26 +125,23 @@ def check_note_hits(utensil, sensor_data, socketio):
                 
                 if condition_met:
                     # Successfully started the hold
-                    with pending_lock:
-                        for n in pending_notes:
-                            if (n["utensil"] == note["utensil"] and 
-                                n["hit_time"] == note["hit_time"]):
-                                n["hold_started"] = True
-                                n["hold_active"] = True
-                                n["last_check_time"] = now
-                                break
-
-                    socketio.emit("note_result", {
+                    with lock:
+                        note["hold_started"] = True
+                        note["hold_active"] = True
+                        note["last_check_time"] = now
+
+                    results.append({
                         "utensil": utensil,
                         "instrument": note["instrument"],
                         "result": "hold_start",
                         "note_type": "hold",
-                        "time": now,
-                        "scheduled": note["hit_time"],
+                        "time": now + MONOTONIC_TO_WALL,
+                        "scheduled": note["hit_time"] + MONOTONIC_TO_WALL,
                         "duration": note["duration"],
                         "accuracy_ms": int(dt * 1000)
                     })
-                    print(f"[HOLD START] {utensil} accuracy {int(dt*1000)}ms, duration {note['duration']:.2f}s")
+                    log.debug("[HOLD START] %s accuracy %dms, duration %.2fs",
+                              utensil, dt * 1000, note['duration'])
 
             # PHASE 2: Maintaining the hold (after started, before end time)
             elif note["hold_active"] and now < note["hold_end_time"]:
@@ -131,150 +149,228 @@ def check_note_hits(utensil, sensor_data, socketio):
                 if note["last_check_time"] and (now - note["last_check_time"]) >= HOLD_CHECK_INTERVAL:
                     if not condition_met:
                         # Broke the hold!
-                        with pending_lock:
-                            for n in pending_notes:
-                                if (n["utensil"] == note["utensil"] and 
-                                    n["hit_time"] == note["hit_time"]):
-                                    n["hold_active"] = False
-                                    n["hold_broken"] = True
-                                    break
+                        with lock:
+                            note["hold_active"] = False
+                            note["hold_broken"] = True
 
                         held_duration = now - note["hit_time"]
-                        socketio.emit("note_result", {
+                        results.append({
                             "utensil": utensil,
                             "instrument": note["instrument"],
                             "result": "hold_break",
                             "note_type": "hold",
-                            "time": now,
-                            "scheduled": note["hit_time"],
+                            "time": now + MONOTONIC_TO_WALL,
+                            "scheduled": note["hit_time"] + MONOTONIC_TO_WALL,
                             "expected_duration": note["duration"],
                             "held_duration": held_duration,
                             "completion_percent": int((held_duration / note["duration"]) * 100)
                         })
-                        print(f"[HOLD BREAK] {utensil} held {held_duration:.2f}s / {note['duration']:.2f}s")
+                        log.debug("[HOLD BREAK] %s held %.2fs / %.2fs",
+                                  utensil, held_duration, note['duration'])
                     else:
                         # Still holding - update check time
-                        with pending_lock:
-                            for n in pending_notes:
-                                if (n["utensil"] == note["utensil"] and 
-                                    n["hit_time"] == note["hit_time"]):
-                                    n["last_check_time"] = now
-                                    break
+                        with lock:
+                            note["last_check_time"] = now
 
             # PHASE 3: Successfully completed the hold
             elif note["hold_active"] and now >= note["hold_end_time"]:
                 # Check one final time if condition is still met
                 if condition_met or (now - note["hold_end_time"]) < HOLD_GRACE_PERIOD:
-                    with pending_lock:
-                        for n in pending_notes:
-                            if (n["utensil"] == note["utensil"] and 
-                                n["hit_time"] == note["hit_time"]):
-                                n["hold_active"] = False
-                                n["hit"] = True  # Mark as complete
-                                break
-
-                    socketio.emit("note_result", {
+                    with lock:
+                        note["hold_active"] = False
+                        note["hit"] = True  # Mark as complete
+
+                    results.append({
                         "utensil": utensil,
                         "instrument": note["instrument"],
                         "result": "hold_complete",
                         "note_type": "hold",
-                        "time": now,
-                        "scheduled": note["hit_time"],
+                        "time": now + MONOTONIC_TO_WALL,
+                        "scheduled": note["hit_time"] + MONOTONIC_TO_WALL,
                         "duration": note["duration"]
                     })
-                    print(f"[HOLD COMPLETE] {utensil} held for {note['duration']:.2f}s")
+                    log.debug("[HOLD COMPLETE] %s held for %.2fs", utensil, note['duration'])
                 else:
                     # Released too early at the end
-                    with pending_lock:
-                        for n in pending_notes:
-                            if (n["utensil"] == note["utensil"] and 
-                                n["hit_time"] == note["hit_time"]):
-                                n["hold_active"] = False
-                                n["hold_broken"] = True
-                                break
-
-                    socketio.emit("note_result", {
+                    with lock:
+                        note["hold_active"] = False
+                        note["hold_broken"] = True
+
+                    results.append({
                         "utensil": utensil,
                         "instrument": note["instrument"],
                         "result": "hold_break",
                         "note_type": "hold",
-                        "time": now,
-                        "scheduled": note["hit_time"],
+                        "time": now + MONOTONIC_TO_WALL,
+                        "scheduled": note["hit_time"] + MONOTONIC_TO_WALL,
                         "expected_duration": note["duration"],
                         "held_duration": note["duration"],
                         "completion_percent": 99
                     })
-                    print(f"[HOLD BREAK] {utensil} released too early at end")
+                    log.debug("[HOLD BREAK] %s released too early at end", utensil)
+
+    return results
+
+
+def check_note_hits(utensil, sensor_data, socketio):
+    """
+    Check if current sensor data hits any pending notes for this utensil.
+    Handles both tap notes and hold notes.
+    
+    Args:
+        utensil: The utensil that sent the data
+        sensor_data: SensorFrame parsed from the MQTT payload
+        socketio: SocketIO instance for emitting events
+    """
+    bucket = pending_notes.get(utensil)
+    if not bucket:  # Unknown instrument, or no notes left for it
+        return
+    lock = pending_locks[utensil]
+
+    now = time.monotonic()
 
-    # Clean up old notes that are past the hit window
-    with pending_lock:
-        pending_notes[:] = [
-            n for n in pending_notes 
-            if not (
-                # Tap notes that are judged or past window
-                (not n["is_hold"] and (n.get("hit") or now > n["hit_time"] + HIT_WINDOW))
-                # Hold notes that are complete or broken
-                or (n["is_hold"] and (n.get("hit") or n.get("hold_broken")))
-            )
-        ]
+    # Get thread-safe copy of the notes that can be judged now. The bucket is
+    # sorted by hit_time and finished notes are popped off its front, so the
+    # copy stops at the first note that is still too early to hit
+    horizon = now + HIT_WINDOW
+    with lock:
+        notes_copy = []
+        for note in bucket:
+            if note["hit_time"] > horizon:
+                break
+            notes_copy.append(note)
+
+    # Next note is still too early to hit; nothing to judge or clean up
+    if not notes_copy:
+        return
+
+    results = _judge_notes(utensil, notes_copy, sensor_data, THRESHOLDS[utensil], now, lock)
+
+    # Clean up finished notes from the front of the bucket
+    with lock:
+        while bucket and _is_done(bucket[0], now):
+            bucket.popleft()
+
+    if results:
+        socketio.emit("note_results", results)
+
+
+# ============================================================================
+# THREAD PRIORITY
+# ============================================================================
+
+def _green_threads():
+    """True if eventlet has patched threading (threads are greenlets on one OS thread)."""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread')
+
+
+def raise_thread_priority(name):
+    """
+    Move the calling thread to SCHED_FIFO so timing work is not delayed
+    behind MQTT, audio and SocketIO threads. Needs Linux and CAP_SYS_NICE
+    (or root); otherwise the thread keeps the default policy.
+
+    Skipped under eventlet: the "thread" is then a greenlet sharing the one
+    OS thread with everything else, so this would make the whole server
+    SCHED_FIFO instead of just the timing loop.
+    
+    Args:
+        name: Thread label for the log message
+    """
+    if _green_threads():
+        log.info("[%s] Running as a greenlet under eventlet, using default scheduling", name)
+        return
+
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(RT_PRIORITY))
+        log.info("[%s] Running with SCHED_FIFO priority %d", name, RT_PRIORITY)
+    except (AttributeError, OSError) as e:  # Not Linux, or not permitted
+        log.warning("[%s] Real-time priority unavailable (%s), using default scheduling", name, e)
 
 
 # ============================================================================
 # MISS DETECTION
 # ============================================================================
 
-def note_miss_checker(socketio, chart_playing_flag):
+def note_miss_checker(socketio, chart_playing_flag, stop_event):
     """
     Background thread that checks for missed notes.
     
     For TAP notes: Mark as miss if hit window expires without being hit
     For HOLD notes: Mark as miss if never started within the hit window
+
+    Sleeps until the earliest pending window closes rather than polling.
     
     Args:
         socketio: SocketIO instance for emitting events
         chart_playing_flag: Function that returns True if chart is still playing
+        stop_event: threading.Event set when playback stops, to wake early
     """
+    raise_thread_priority("MISS CHECKER")
+
     while chart_playing_flag():
-        now = time.time()
+        now = time.monotonic()
+        next_deadline = None
+        results = []  # misses found this pass, sent as one batch
         
-        with pending_lock:
-            for note in pending_notes:
-                # Skip if already processed
-                if note["hit"] or note.get("hold_broken"):
-                    continue
+        for utensil, bucket in pending_notes.items():
+            with pending_locks[utensil]:
+                for note in bucket:
+                    # Notes are kept in hit_time order, so once one is still
+                    # inside its window every later note is too
+                    deadline = note["hit_time"] + HIT_WINDOW
+                    if now <= deadline:
+                        if next_deadline is None or deadline < next_deadline:
+                            next_deadline = deadline
+                        break
 
-                # TAP NOTE: Miss if past the hit window and never hit
-                if not note["is_hold"]:
-                    if now > note["hit_time"] + HIT_WINDOW:
+                    # Skip if already processed
+                    if note["hit"] or note.get("hold_broken"):
+                        continue
+
+                    # TAP NOTE: Miss if past the hit window and never hit
+                    if not note["is_hold"]:
                         note["hit"] = True
-                        
-                        socketio.emit("note_result", {
+                    
+                        results.append({
                             "instrument": note["instrument"],
                             "utensil": note["utensil"],
                             "result": "miss",
                             "note_type": "tap",
-                            "scheduled": note["hit_time"],
-                            "actual_time": now
+                            "scheduled": note["hit_time"] + MONOTONIC_TO_WALL,
+                            "actual_time": now + MONOTONIC_TO_WALL
                         })
-                        
+                    
                         if note['utensil'] == 'pan':
-                            print(f"[TAP MISS] {note['utensil']} missed note at {note['hit_time']}")
+                            log.debug("[TAP MISS] %s missed note at %s", note['utensil'], note['hit_time'])
 
-                # HOLD NOTE: Miss if never started within the hit window
-                elif not note["hold_started"] and now > note["hit_time"] + HIT_WINDOW:
-                    note["hold_broken"] = True
+                    # HOLD NOTE: Miss if never started within the hit window
+                    elif not note["hold_started"]:
+                        note["hold_broken"] = True
                     
-                    socketio.emit("note_result", {
-                        "instrument": note["instrument"],
-                        "utensil": note["utensil"],
-                        "result": "miss",
-                        "note_type": "hold",
-                        "scheduled": note["hit_time"],
-                        "actual_time": now,
-                        "expected_duration": note["duration"]
-                    })
+                        results.append({
+                            "instrument": note["instrument"],
+                            "utensil": note["utensil"],
+                            "result": "miss",
+                            "note_type": "hold",
+                            "scheduled": note["hit_time"] + MONOTONIC_TO_WALL,
+                            "actual_time": now + MONOTONIC_TO_WALL,
+                            "expected_duration": note["duration"]
+                        })
                     
-                    if note['utensil'] == 'pan':
-                        print(f"[HOLD MISS] {note['utensil']} never started hold at {note['hit_time']}")
+                        if note['utensil'] == 'pan':
+                            log.debug("[HOLD MISS] %s never started hold at %s", note['utensil'], note['hit_time'])
 
-        time.sleep(0.01)  # 10ms tick to avoid busy-wait
\ No newline at end of file
+        if results:
+            socketio.emit("note_results", results)
+
+        # Wake when the next window closes (notes are only added at chart start)
+        if next_deadline is None:
+            timeout = MISS_CHECK_IDLE
+        else:
+            timeout = max(0.001, next_deadline - time.monotonic())
+        stop_event.wait(timeout)
\ No newline at end of file
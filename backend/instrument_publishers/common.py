@@ -0,0 +1,192 @@
+"""
+Shared helpers for the kitchen instrument publishers
+Device identity, MQTT settings, display setup and payload encoding
+used by the knife, pan and mixing bowl publishers
+"""
+
+import board
+import json
+import uuid
+import socket
+import fcntl
+import struct
+import functools
+from queue import Full, Empty
+
+# Optional: Display support (comment out if no display)
+try:
+    import digitalio
+    from PIL import Image, ImageDraw, ImageFont
+    import adafruit_rgb_display.st7789 as st7789
+    DISPLAY_AVAILABLE = True
+except ImportError:
+    DISPLAY_AVAILABLE = False
+    print("Display libraries not available - running in headless mode")
+
+
+# Optional: faster JSON encoding (falls back to the stdlib json module)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Optional: binary MessagePack payloads (smaller than JSON on the wire)
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+
+# MQTT Configuration
+MQTT_BROKER = 'farlab.infosci.cornell.edu'
+MQTT_PORT = 1883  # Changed to non-TLS port
+MQTT_TOPIC = 'IDD/kitchen-instrument'
+MQTT_USERNAME = 'idd'
+MQTT_PASSWORD = 'device@theFarm'
+
+# Send MessagePack instead of JSON where publishers use encode_payload().
+# Only enable once the server has msgpack installed too
+USE_MSGPACK = False
+
+# Kernel send buffer for the MQTT socket (bytes)
+SEND_BUFFER_SIZE = 4096
+
+# ioctl request for an interface's IPv4 address (linux/sockios.h)
+SIOCGIFADDR = 0x8915
+
+
+def encode_json(obj):
+    """Serialize obj to compact JSON bytes, using orjson when available"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def encode_payload(obj):
+    """Serialize a whole MQTT payload: MessagePack if enabled, else compact JSON"""
+    if USE_MSGPACK and MSGPACK_AVAILABLE:
+        return msgpack.packb(obj, use_bin_type=True)
+    return encode_json(obj)
+
+
+@functools.lru_cache(maxsize=None)
+def get_mac_address():
+    """Get the MAC address of the primary network interface"""
+    # Try to get MAC from eth0 or wlan0 (read sysfs directly, no subprocess)
+    for ifname in ('eth0', 'wlan0'):
+        try:
+            with open(f'/sys/class/net/{ifname}/address') as f:
+                mac = f.read().strip()
+            if mac:
+                return mac
+        except OSError:
+            continue
+    
+    # Fallback to UUID if MAC can't be determined
+    return str(uuid.uuid1())
+
+
+@functools.lru_cache(maxsize=None)
+def get_ip_address():
+    """Get the IP address of this device (from the default-route interface)"""
+    try:
+        # The default route is the entry whose destination is 00000000
+        with open('/proc/net/route') as f:
+            next(f)  # Skip header
+            ifname = next(fields[0] for fields in map(str.split, f)
+                          if fields[1] == '00000000')
+
+        # Ask the kernel for that interface's IPv4 address (no network traffic)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            ifreq = fcntl.ioctl(s.fileno(), SIOCGIFADDR,
+                                struct.pack('256s', ifname[:15].encode()))
+        finally:
+            s.close()
+        return socket.inet_ntoa(ifreq[20:24])
+    except (OSError, StopIteration):
+        return "unknown"
+
+
+def setup_display():
+    """Setup the MiniPiTFT display if available"""
+    if not DISPLAY_AVAILABLE:
+        return None, None, None, None, None
+    
+    try:
+        # Configuration for CS and DC pins
+        # Use GPIO5 instead of CE0 to avoid SPI conflicts
+        cs_pin = digitalio.DigitalInOut(board.D5)   # GPIO5 (PIN 29)
+        dc_pin = digitalio.DigitalInOut(board.D25)  # GPIO25 (PIN 22)
+        reset_pin = None
+
+        # Config for display baudrate
+        BAUDRATE = 64000000
+
+        backlight = digitalio.DigitalInOut(board.D22)
+        backlight.switch_to_output()
+        backlight.value = True
+        
+        # Buttons with pull-ups (active LOW when pressed)
+        buttonA = digitalio.DigitalInOut(board.D23)
+        buttonB = digitalio.DigitalInOut(board.D24)
+        buttonA.switch_to_input(pull=digitalio.Pull.UP)
+        buttonB.switch_to_input(pull=digitalio.Pull.UP)
+
+        # Setup SPI bus using hardware SPI
+        spi = board.SPI()
+
+        # Create the ST7789 display
+        disp = st7789.ST7789(
+            spi,
+            cs=cs_pin,
+            dc=dc_pin,
+            rst=reset_pin,
+            baudrate=BAUDRATE,
+            width=135,
+            height=240,
+            x_offset=53,
+            y_offset=40,
+            rotation=90  # Rotate 90 degrees for vertical orientation
+        )
+
+        # After rotation, width and height are swapped
+        width = 240
+        height = 135
+        image = Image.new("RGB", (width, height))
+        draw = ImageDraw.Draw(image)
+        
+        print("[OK] Display initialized (240x135 rotated)")
+
+        return disp, draw, image, buttonA, buttonB
+    except Exception as e:
+        print(f"Error setting up display: {e}")
+        return None, None, None, None, None
+
+
+def on_connect(client, userdata, flags, rc):
+    """Callback when connected to MQTT broker"""
+    if rc == 0:
+        print(f"[OK] Connected to MQTT broker: {MQTT_BROKER}")
+        # Send each small reading immediately (no Nagle coalescing) and keep
+        # the kernel send buffer small so a stalled broker can't back up old data
+        sock = client.socket()
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+    else:
+        print(f"[ERROR] Connection failed with code {rc}")
+
+
+def offer_latest(slot, payload):
+    """Put payload in the one-item slot, replacing an older one not yet sent"""
+    try:
+        slot.put_nowait(payload)
+    except Full:
+        try:
+            slot.get_nowait()  # Drop the stale payload
+        except Empty:
+            pass
+        slot.put_nowait(payload)
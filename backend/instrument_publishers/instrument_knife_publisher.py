@@ -11,130 +11,37 @@ import adafruit_apds9960.apds9960
 import adafruit_mpr121
 import time
 import paho.mqtt.client as mqtt
-import uuid
 import signal
 import ssl
 import json
-import socket
-import subprocess
+import threading
+from queue import Queue
 
-# Optional: Display support (comment out if no display)
-try:
-    import digitalio
-    from PIL import Image, ImageDraw, ImageFont
-    import adafruit_rgb_display.st7789 as st7789
-    DISPLAY_AVAILABLE = True
-except ImportError:
-    DISPLAY_AVAILABLE = False
-    print("Display libraries not available - running in headless mode")
-
-
-# MQTT Configuration
-MQTT_BROKER = 'farlab.infosci.cornell.edu'
-MQTT_PORT = 1883  # Changed to non-TLS port
-MQTT_TOPIC = 'IDD/kitchen-instrument'
-MQTT_USERNAME = 'idd'
-MQTT_PASSWORD = 'device@theFarm'
+from common import (MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_USERNAME, MQTT_PASSWORD,
+                    get_mac_address, get_ip_address, on_connect, encode_json, offer_latest)
 
 # Publishing interval (seconds)
 PUBLISH_INTERVAL = 0.1
 
 
-def get_mac_address():
-    """Get the MAC address of the primary network interface"""
-    try:
-        # Try to get MAC from eth0 or wlan0
-        result = subprocess.run(['cat', '/sys/class/net/eth0/address'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip()
-        
-        result = subprocess.run(['cat', '/sys/class/net/wlan0/address'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip()
-    except Exception as e:
-        print(f"Error getting MAC address: {e}")
-    
-    # Fallback to UUID if MAC can't be determined
-    return str(uuid.uuid1())
-
-
-def get_ip_address():
-    """Get the IP address of this device"""
-    try:
-        # Connect to external host to determine local IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "unknown"
-
+# Pads the game listens to (bit i = pad i): pads 0, 1 and 2
+RELEVANT_PADS = 0x07
 
-def setup_display():
-    """Setup the MiniPiTFT display if available"""
-    if not DISPLAY_AVAILABLE:
-        return None, None, None, None, None
-    
-    try:
-        # Configuration for CS and DC pins
-        # Use GPIO5 instead of CE0 to avoid SPI conflicts
-        cs_pin = digitalio.DigitalInOut(board.D5)   # GPIO5 (PIN 29)
-        dc_pin = digitalio.DigitalInOut(board.D25)  # GPIO25 (PIN 22)
-        reset_pin = None
-
-        # Config for display baudrate
-        BAUDRATE = 64000000
-
-        backlight = digitalio.DigitalInOut(board.D22)
-        backlight.switch_to_output()
-        backlight.value = True
-        
-        # Buttons with pull-ups (active LOW when pressed)
-        buttonA = digitalio.DigitalInOut(board.D23)
-        buttonB = digitalio.DigitalInOut(board.D24)
-        buttonA.switch_to_input(pull=digitalio.Pull.UP)
-        buttonB.switch_to_input(pull=digitalio.Pull.UP)
-
-        # Setup SPI bus using hardware SPI
-        spi = board.SPI()
-
-        # Create the ST7789 display
-        disp = st7789.ST7789(
-            spi,
-            cs=cs_pin,
-            dc=dc_pin,
-            rst=reset_pin,
-            baudrate=BAUDRATE,
-            width=135,
-            height=240,
-            x_offset=53,
-            y_offset=40,
-            rotation=90  # Rotate 90 degrees for vertical orientation
-        )
-
-        # After rotation, width and height are swapped
-        width = 240
-        height = 135
-        image = Image.new("RGB", (width, height))
-        draw = ImageDraw.Draw(image)
-        
-        print("[OK] Display initialized (240x135 rotated)")
-
-        return disp, draw, image, buttonA, buttonB
-    except Exception as e:
-        print(f"Error setting up display: {e}")
-        return None, None, None, None, None
 
+def publish_worker(client, slot):
+    """Publish payloads from the slot so the sensor loop never blocks on MQTT"""
+    while True:
+        mqtt_payload = slot.get()
+        try:
+            result = client.publish(MQTT_TOPIC, mqtt_payload, qos=0)
+        except Exception as e:
+            print(f"[ERROR] Publish raised: {e}")
+            continue
 
-def on_connect(client, userdata, flags, rc):
-    """Callback when connected to MQTT broker"""
-    if rc == 0:
-        print(f"[OK] Connected to MQTT broker: {MQTT_BROKER}")
-    else:
-        print(f"[ERROR] Connection failed with code {rc}")
+        if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            print(f"[OK] Published touch data: {mqtt_payload.decode()}")
+        else:
+            print(f"[ERROR] Publish failed: rc={result.rc}")
 
 
 def main():
@@ -172,7 +79,9 @@ def main():
     
     # Setup MQTT client
     print("Connecting to MQTT broker...")
-    client = mqtt.Client(str(uuid.uuid1()))
+    # Stable id per device, so a reconnect replaces its old connection on the broker
+    client_id = f"cutting_board-{mac_address.replace(':', '')}"
+    client = mqtt.Client(client_id)
     # Remove TLS for non-encrypted connection
     # client.tls_set(cert_reqs=ssl.CERT_NONE)
     client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
@@ -201,6 +110,10 @@ def main():
         exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
+
+    # Latest-value slot: the sensor loop overwrites, the publisher thread drains
+    publish_slot = Queue(maxsize=1)
+    threading.Thread(target=publish_worker, args=(client, publish_slot), daemon=True).start()
     
     print("\n" + "=" * 50)
     print("Streaming kitchen instrument data...")
@@ -208,10 +121,18 @@ def main():
     print("Press Ctrl+C to exit")
     print("=" * 50 + "\n")
     
-    last_publish_time = 0
+    utensil = 'cutting_board'
+
+    # mac/ip/utensil never change, so serialize that part of the payload once
+    payload_prefix = ('{"mac": %s, "ip": %s, "utensil": %s, "data": ' % (
+        json.dumps(mac_address), json.dumps(ip_address), json.dumps(utensil))).encode()
+
+    # Pace on a monotonic deadline: one read/publish per PUBLISH_INTERVAL
+    next_deadline = time.monotonic()
     
     # Main loop
     while True:
+        next_deadline += PUBLISH_INTERVAL
         try:
             # Read color sensor
             # r, g, b, a = sensor.color_data
@@ -237,8 +158,6 @@ def main():
             # else:
             #     r = g = b = 0
 
-            utensil = 'cutting_board'
-            
             # Create JSON payload for display and MQTT
             # payload = json.dumps({
             #     'mac': mac_address,
@@ -274,42 +193,30 @@ def main():
             #     disp.image(image)
             
             # Publish to MQTT at specified interval
-            current_time = time.time()
-            if current_time - last_publish_time >= PUBLISH_INTERVAL:
-
-                try:
-                    touched = {str(i): int(touch_sensor[i].value) for i in range(12)}
-                    active_pads = [k for k, v in touched.items() if v == 1]
-                    print(f"Touched pads: {active_pads}")
-                except Exception as e:
-                    print("Sensor read error:", e)
-                    touched = {str(i): 0 for i in range(12)}
-
-                # --- ONLY STREAM WHEN PAD 1 OR 2 OR 3 IS PRESSED ---
-                pad1 = touched.get("0", 0)
-                pad2 = touched.get("1", 0)
-                pad3 = touched.get("2", 0)
-
-                if pad1 == 1 or pad2 == 1 or pad3 == 1:
-                    mqtt_payload = json.dumps({
-                        'mac': mac_address,
-                        'ip': ip_address,
-                        'utensil': utensil,
-                        'data': touched,
-                        'timestamp': int(current_time)
-                    })
-
-                    result = client.publish(MQTT_TOPIC, mqtt_payload)
-
-                    if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                        print(f"[OK] Published touch data: {mqtt_payload}")
-                    else:
-                        print(f"[ERROR] Publish failed: rc={result.rc}")
-                else:
-                    print("No relevant pads touched skipping publish.")
-
-                last_publish_time = current_time
-            time.sleep(0.1)  # Small delay to prevent CPU spinning
+            current_time = time.time()  # wall clock, for the payload timestamp
+
+            try:
+                # One burst read of the touch status registers (bit i = pad i)
+                mask = touch_sensor.touched()
+            except Exception as e:
+                print("Sensor read error:", e)
+                mask = 0
+
+            # --- ONLY STREAM WHEN PAD 1 OR 2 OR 3 IS PRESSED ---
+            # Checked on the raw mask so idle cycles build nothing
+            if mask & RELEVANT_PADS:
+                # Send the raw bitmask (bit i = pad i); the server decodes it
+                mqtt_payload = (payload_prefix + encode_json({'pads': mask})
+                                + b', "timestamp": %d}' % int(current_time))
+
+                offer_latest(publish_slot, mqtt_payload)
+
+            # Sleep exactly until the next tick instead of a fixed delay
+            sleep_for = next_deadline - time.monotonic()
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+            else:
+                next_deadline = time.monotonic()  # Overran; don't burst to catch up
             
         except Exception as e:
             print(f"Error in main loop: {e}")
@@ -7,141 +7,37 @@ Reads distance sensor and sends to server
 import board
 import busio
 import adafruit_apds9960.apds9960
-from adafruit_seesaw import seesaw, rotaryio, digitalio
+from adafruit_seesaw import seesaw, rotaryio
 import time
 import paho.mqtt.client as mqtt
-import uuid
 import signal
 import ssl
-import json
-import socket
-import subprocess
+import threading
+from queue import Queue
 
 import qwiic_proximity
 import time
 import sys
 
-# Optional: Display support (comment out if no display)
+from common import (MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_USERNAME, MQTT_PASSWORD,
+                    get_mac_address, get_ip_address, setup_display, on_connect,
+                    encode_payload, offer_latest)
+
+# Optional: fonts for the status display (setup_display returns None if unavailable)
 try:
-    import digitalio
-    from PIL import Image, ImageDraw, ImageFont
-    import adafruit_rgb_display.st7789 as st7789
-    DISPLAY_AVAILABLE = True
+    from PIL import ImageFont
 except ImportError:
-    DISPLAY_AVAILABLE = False
-    print("Display libraries not available - running in headless mode")
-
-
-# MQTT Configuration
-MQTT_BROKER = 'farlab.infosci.cornell.edu'
-MQTT_PORT = 1883  # Changed to non-TLS port
-MQTT_TOPIC = 'IDD/kitchen-instrument'
-MQTT_USERNAME = 'idd'
-MQTT_PASSWORD = 'device@theFarm'
+    pass
 
 # Publishing interval (seconds)
 PUBLISH_INTERVAL = 0.1
 
+
 # Jittering thresholds
 DISTANCE_DEADZONE = 20
 ROTATION_DEADZONE = 0
 PRESS_THRESHOLD = 10000
 
-def get_mac_address():
-    """Get the MAC address of the primary network interface"""
-    try:
-        # Try to get MAC from eth0 or wlan0
-        result = subprocess.run(['cat', '/sys/class/net/eth0/address'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip()
-        
-        result = subprocess.run(['cat', '/sys/class/net/wlan0/address'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip()
-    except Exception as e:
-        print(f"Error getting MAC address: {e}")
-    
-    # Fallback to UUID if MAC can't be determined
-    return str(uuid.uuid1())
-
-
-def get_ip_address():
-    """Get the IP address of this device"""
-    try:
-        # Connect to external host to determine local IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "unknown"
-
-
-def setup_display():
-    """Setup the MiniPiTFT display if available"""
-    if not DISPLAY_AVAILABLE:
-        return None, None, None, None, None
-    
-    try:
-        # Configuration for CS and DC pins
-        # Use GPIO5 instead of CE0 to avoid SPI conflicts
-        cs_pin = digitalio.DigitalInOut(board.D5)   # GPIO5 (PIN 29)
-        dc_pin = digitalio.DigitalInOut(board.D25)  # GPIO25 (PIN 22)
-        reset_pin = None
-
-        # Config for display baudrate
-        BAUDRATE = 64000000
-
-        backlight = digitalio.DigitalInOut(board.D22)
-        backlight.switch_to_output()
-        backlight.value = True
-        
-        # Buttons with pull-ups (active LOW when pressed)
-        buttonA = digitalio.DigitalInOut(board.D23)
-        buttonB = digitalio.DigitalInOut(board.D24)
-        buttonA.switch_to_input(pull=digitalio.Pull.UP)
-        buttonB.switch_to_input(pull=digitalio.Pull.UP)
-
-        # Setup SPI bus using hardware SPI
-        spi = board.SPI()
-
-        # Create the ST7789 display
-        disp = st7789.ST7789(
-            spi,
-            cs=cs_pin,
-            dc=dc_pin,
-            rst=reset_pin,
-            baudrate=BAUDRATE,
-            width=135,
-            height=240,
-            x_offset=53,
-            y_offset=40,
-            rotation=90  # Rotate 90 degrees for vertical orientation
-        )
-
-        # After rotation, width and height are swapped
-        width = 240
-        height = 135
-        image = Image.new("RGB", (width, height))
-        draw = ImageDraw.Draw(image)
-        
-        print("[OK] Display initialized (240x135 rotated)")
-
-        return disp, draw, image, buttonA, buttonB
-    except Exception as e:
-        print(f"Error setting up display: {e}")
-        return None, None, None, None, None
-
-
-def on_connect(client, userdata, flags, rc):
-    """Callback when connected to MQTT broker"""
-    if rc == 0:
-        print(f"[OK] Connected to MQTT broker: {MQTT_BROKER}")
-    else:
-        print(f"[ERROR] Connection failed with code {rc}")
 
 def has_changed(prev, current):
     """Return True if the new value differs enough from the old value."""
@@ -166,6 +62,26 @@ def has_changed(prev, current):
     return False
 
 
+def publish_worker(client, slot):
+    """Publish payloads from the slot so the sensor loop never blocks on MQTT"""
+    while True:
+        mqtt_payload = slot.get()
+        try:
+            result = client.publish(MQTT_TOPIC, mqtt_payload, qos=0)
+        except Exception as e:
+            print(f"[ERROR] Publish raised: {e}")
+            continue
+
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            print(f"[ERROR] Publish failed: rc={result.rc}")
+            if not client.is_connected():
+                print("[ERROR] MQTT client disconnected! Attempting to reconnect...")
+                try:
+                    client.reconnect()
+                except Exception as e:
+                    print(f"[ERROR] Reconnect failed: {e}")
+
+
 def main():
     print("=" * 50)
     print("  Kitchen Instrument - Pi Publisher")
@@ -211,7 +127,9 @@ def main():
             
     # Setup MQTT client
     print("Connecting to MQTT broker...")
-    client = mqtt.Client(str(uuid.uuid1()))
+    # Stable id per device, so a reconnect replaces its old connection on the broker
+    client_id = f"pan-{mac_address.replace(':', '')}"
+    client = mqtt.Client(client_id)
     # Remove TLS for non-encrypted connection
     # client.tls_set(cert_reqs=ssl.CERT_NONE)
     client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
@@ -240,6 +158,10 @@ def main():
         exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
+
+    # Latest-value slot: the sensor loop overwrites, the publisher thread drains
+    publish_slot = Queue(maxsize=1)
+    threading.Thread(target=publish_worker, args=(client, publish_slot), daemon=True).start()
     
     print("\n" + "=" * 50)
     print("Streaming kitchen instrument data...")
@@ -333,7 +255,7 @@ def main():
             
             if has_changed(previous_data, current_data):
 
-                mqtt_payload = json.dumps({
+                mqtt_payload = encode_payload({
                     'mac': mac_address,
                     'ip': ip_address,
                     'utensil': utensil,
@@ -341,19 +263,9 @@ def main():
                     'timestamp': int(time.time())
                 })
 
-                result = client.publish(MQTT_TOPIC, mqtt_payload)
-                
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    # print(f"[OK] Streaming: RGB({r:3d}, {g:3d}, {b:3d}) | {mac_address[:17]} | rc:{result.rc} mid:{result.mid}")
-                    print(f"     Payload: {mqtt_payload}")
-                else:
-                    print(f"[ERROR] Publish failed: rc={result.rc}")
-                    if not client.is_connected():
-                        print("[ERROR] MQTT client disconnected! Attempting to reconnect...")
-                        try:
-                            client.reconnect()
-                        except Exception as e:
-                            print(f"[ERROR] Reconnect failed: {e}")
+                # Hand off to the publisher thread
+                offer_latest(publish_slot, mqtt_payload)
+                print(f"     Payload: {current_data}")
             previous_data = current_data.copy()
             time.sleep(0.1)  # Small delay to prevent CPU spinning
             
@@ -5,18 +5,17 @@ Reads RGB color sensor and publishes to collaborative pixel grid
 Each Pi is identified by MAC address and gets a stable position in the grid
 """
 
-import board
 import busio
 import adafruit_apds9960.apds9960
 import time
 import paho.mqtt.client as mqtt
-import uuid
 import signal
 import ssl
 import json
-import socket
-import subprocess
+import threading
+from queue import Queue
 import math
+from collections import deque
 
 
 # for joystick
@@ -24,28 +23,19 @@ import qwiic_joystick
 import time
 import sys
 
+from common import (MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_USERNAME, MQTT_PASSWORD,
+                    get_mac_address, get_ip_address, on_connect, offer_latest)
 
+# Publishing interval (seconds)
+PUBLISH_INTERVAL = 0.1
 
-# Optional: Display support (comment out if no display)
-try:
-    import digitalio
-    from PIL import Image, ImageDraw, ImageFont
-    import adafruit_rgb_display.st7789 as st7789
-    DISPLAY_AVAILABLE = True
-except ImportError:
-    DISPLAY_AVAILABLE = False
-    print("Display libraries not available - running in headless mode")
-
+# Joystick sampling interval (seconds); the circle detector needs every step
+SAMPLE_INTERVAL = 0.05
+TICKS_PER_PUBLISH = round(PUBLISH_INTERVAL / SAMPLE_INTERVAL)
 
-# MQTT Configuration
-MQTT_BROKER = 'farlab.infosci.cornell.edu'
-MQTT_PORT = 1883  # Changed to non-TLS port
-MQTT_TOPIC = 'IDD/kitchen-instrument'
-MQTT_USERNAME = 'idd'
-MQTT_PASSWORD = 'device@theFarm'
+# Rest of the payload after the constant prefix; only the numbers change per tick
+DATA_TEMPLATE = b'{"x": %d, "y": %d, "speed": %.1f, "radius": %.1f}, "timestamp": %d}'
 
-# Publishing interval (seconds)
-PUBLISH_INTERVAL = 0.1
 
 # Joystick center position (calibrate based on your joystick)
 CENTER_X = 519
@@ -53,13 +43,45 @@ CENTER_Y = 517
 
 # Minimum radius to consider as "stirring" (not just resting at center)
 MIN_RADIUS = 200  # Adjust this based on how far from center you move
+MIN_RADIUS_SQ = MIN_RADIUS * MIN_RADIUS  # compared against dx*dx + dy*dy, no sqrt needed
+
+# One full turn, in the radians the detector accumulates
+FULL_CIRCLE = 2 * math.pi
+
+# Joystick data registers: X MSB/LSB, Y MSB/LSB, button (contiguous from 0x03)
+JOYSTICK_DATA_REG = 0x03
+JOYSTICK_DATA_LEN = 5
+
+
+def read_joystick(joystick):
+    """
+    Read x, y and button in one I2C block read instead of three property reads.
+    Falls back to the driver properties if the block read is unavailable.
+    """
+    try:
+        data = joystick._i2c.readBlock(joystick.address, JOYSTICK_DATA_REG, JOYSTICK_DATA_LEN)
+    except Exception:
+        return joystick.horizontal, joystick.vertical, joystick.button
+
+    # Axes are 10-bit values left-aligned in 16 bits, same as the driver's decode
+    x = ((data[0] << 8) | data[1]) >> 6
+    y = ((data[2] << 8) | data[3]) >> 6
+    return x, y, data[4]
+
 
 class CircleDetector:
     """Detects when joystick completes a full circle"""
+
+    # Fixed attribute set: no per-instance __dict__ on the 20 Hz update path
+    __slots__ = ('prev_dx', 'prev_dy', 'accumulated_angle', 'circles_completed',
+                 'in_motion', 'circle_start_time', 'last_circle_duration',
+                 'last_circle_speed', 'angle_history', 'angle_sum',
+                 'history_window', 'current_speed')
     
     def __init__(self):
-        self.last_angle = None
-        self.accumulated_angle = 0
+        self.prev_dx = None  # last offset from center; angle steps come from
+        self.prev_dy = None  # cross/dot products against it, no absolute angle
+        self.accumulated_angle = 0  # radians
         self.circles_completed = 0
         self.in_motion = False
 
@@ -69,35 +91,25 @@ class CircleDetector:
         self.last_circle_speed = 0      # average speed (degrees/sec) for last completed circle
 
         # [NEW] real-time speed calculation
-        self.angle_history = []  # store the history of (time, angle change)
+        self.angle_history = deque()  # store the history of (time, angle change in radians)
+        self.angle_sum = 0  # running sum of the angle changes in angle_history
         self.history_window = 0.5  # use 0.5 seconds window to calculate speed
         self.current_speed = 0  # real-time angle speed (degrees/sec)
         
-    def get_angle(self, x, y):
-        """Calculate angle from center (-180 to 180 degrees)"""
-        dx = x - CENTER_X
-        dy = y - CENTER_Y
-        
-        # Check if we're far enough from center
-        radius = math.sqrt(dx*dx + dy*dy)
-        if radius < MIN_RADIUS:
-            return None, radius
-        
-        # Calculate angle in degrees
-        angle = math.degrees(math.atan2(dy, dx))
-        return angle, radius
-    
     def update(self, x, y):
         """Update with new position and return if circle completed"""
         current_time = time.time()
-        angle, radius = self.get_angle(x, y)
+        dx = x - CENTER_X
+        dy = y - CENTER_Y
         
-        # Not moving enough to count
+        # Not moving enough to count (squared radius, no sqrt)
         # don't forget to return to IDLE state
-        if angle is None:
+        r2 = dx*dx + dy*dy
+        if r2 < MIN_RADIUS_SQ:
             self.current_speed = 0 
             self.in_motion = False
             return False, 0, "IDLE"
+        radius = math.sqrt(r2)
         
         self.in_motion = True
 
@@ -106,38 +118,37 @@ class CircleDetector:
             self.circle_start_time = time.time()
         
         # First valid reading the angle
-        if self.last_angle is None:
-            self.last_angle = angle
+        if self.prev_dx is None:
+            self.prev_dx, self.prev_dy = dx, dy
             return False, radius, "IDLE"
         
-        # Calculate angle difference
-        diff = angle - self.last_angle
-        
-        # Handle wraparound (-180 to 180 boundary)
-        if diff > 180:
-            diff -= 360
-        elif diff < -180:
-            diff += 360
+        # Signed angle between the previous and current offsets (radians,
+        # already in -pi..pi so there is no wraparound to fix up)
+        cross = self.prev_dx*dy - self.prev_dy*dx
+        dot = self.prev_dx*dx + self.prev_dy*dy
+        diff = math.atan2(cross, dot)
 
 
         # [NEW] record the angle change to history
         self.angle_history.append((current_time, diff))
+        self.angle_sum += diff
         
-        # [NEW] clear old data (beyond history_window)
-        self.angle_history = [(t, d) for t, d in self.angle_history 
-                              if current_time - t <= self.history_window]
+        # [NEW] clear old data (beyond history_window), oldest first
+        while current_time - self.angle_history[0][0] > self.history_window:
+            _, old_diff = self.angle_history.popleft()
+            self.angle_sum -= old_diff
         
         # [NEW] calculate real-time speed (average angular speed over recent time window)
         if len(self.angle_history) >= 2:
-            total_angle = sum(d for _, d in self.angle_history)
+            total_angle = self.angle_sum
             time_span = current_time - self.angle_history[0][0]
             if time_span > 0:
-                self.current_speed = abs(total_angle / time_span)  # degrees/sec
+                self.current_speed = math.degrees(abs(total_angle / time_span))  # degrees/sec
 
         
         # Accumulate the angle change
         self.accumulated_angle += diff
-        self.last_angle = angle
+        self.prev_dx, self.prev_dy = dx, dy
 
 
         # [NEW] identify the speed state based on current speed
@@ -150,11 +161,11 @@ class CircleDetector:
         
         # Check if completed a full circle (360 degrees in either direction)
         circle_completed = False
-        if abs(self.accumulated_angle) >= 360:
+        if abs(self.accumulated_angle) >= FULL_CIRCLE:
             self.circles_completed += 1
             circle_completed = True
             # Reset but keep the remainder
-            self.accumulated_angle = self.accumulated_angle % 360
+            self.accumulated_angle = self.accumulated_angle % FULL_CIRCLE
             print(f"\n HIT!! Circle #{self.circles_completed} completed! \n")
 
 
@@ -171,102 +182,6 @@ class CircleDetector:
         return circle_completed, radius, speed_state
 
 
-def get_mac_address():
-    """Get the MAC address of the primary network interface"""
-    try:
-        # Try to get MAC from eth0 or wlan0
-        result = subprocess.run(['cat', '/sys/class/net/eth0/address'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip()
-        
-        result = subprocess.run(['cat', '/sys/class/net/wlan0/address'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip()
-    except Exception as e:
-        print(f"Error getting MAC address: {e}")
-    
-    # Fallback to UUID if MAC can't be determined
-    return str(uuid.uuid1())
-
-
-def get_ip_address():
-    """Get the IP address of this device"""
-    try:
-        # Connect to external host to determine local IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "unknown"
-
-
-def setup_display():
-    """Setup the MiniPiTFT display if available"""
-    if not DISPLAY_AVAILABLE:
-        return None, None, None, None, None
-    
-    try:
-        # Configuration for CS and DC pins
-        # Use GPIO5 instead of CE0 to avoid SPI conflicts
-        cs_pin = digitalio.DigitalInOut(board.D5)   # GPIO5 (PIN 29)
-        dc_pin = digitalio.DigitalInOut(board.D25)  # GPIO25 (PIN 22)
-        reset_pin = None
-
-        # Config for display baudrate
-        BAUDRATE = 64000000
-
-        backlight = digitalio.DigitalInOut(board.D22)
-        backlight.switch_to_output()
-        backlight.value = True
-        
-        # Buttons with pull-ups (active LOW when pressed)
-        buttonA = digitalio.DigitalInOut(board.D23)
-        buttonB = digitalio.DigitalInOut(board.D24)
-        buttonA.switch_to_input(pull=digitalio.Pull.UP)
-        buttonB.switch_to_input(pull=digitalio.Pull.UP)
-
-        # Setup SPI bus using hardware SPI
-        spi = board.SPI()
-
-        # Create the ST7789 display
-        disp = st7789.ST7789(
-            spi,
-            cs=cs_pin,
-            dc=dc_pin,
-            rst=reset_pin,
-            baudrate=BAUDRATE,
-            width=135,
-            height=240,
-            x_offset=53,
-            y_offset=40,
-            rotation=90  # Rotate 90 degrees for vertical orientation
-        )
-
-        # After rotation, width and height are swapped
-        width = 240
-        height = 135
-        image = Image.new("RGB", (width, height))
-        draw = ImageDraw.Draw(image)
-        
-        print("[OK] Display initialized (240x135 rotated)")
-
-        return disp, draw, image, buttonA, buttonB
-    except Exception as e:
-        print(f"Error setting up display: {e}")
-        return None, None, None, None, None
-
-
-def on_connect(client, userdata, flags, rc):
-    """Callback when connected to MQTT broker"""
-    if rc == 0:
-        print(f"[OK] Connected to MQTT broker: {MQTT_BROKER}")
-    else:
-        print(f"[ERROR] Connection failed with code {rc}")
-
 def runExample_joystick():
     #? This is the joystick example from Lab 4
 
@@ -291,6 +206,29 @@ def runExample_joystick():
 
 		time.sleep(.5)
 
+
+def publish_worker(client, slot):
+    """Publish payloads from the slot so the sensor loop never blocks on MQTT"""
+    while True:
+        mqtt_payload = slot.get()
+        try:
+            result = client.publish(MQTT_TOPIC, mqtt_payload, qos=0)
+        except Exception as e:
+            print(f"[ERROR] Publish raised: {e}")
+            continue
+
+        if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            print(f"     Payload: {mqtt_payload.decode()}")
+        else:
+            print(f"[ERROR] Publish failed: rc={result.rc}")
+            if not client.is_connected():
+                print("[ERROR] MQTT client disconnected! Attempting to reconnect...")
+                try:
+                    client.reconnect()
+                except Exception as e:
+                    print(f"[ERROR] Reconnect failed: {e}")
+
+
 def main():
     print("=" * 50)
     print("  Kitchen Instrument - Pi Publisher")
@@ -322,7 +260,9 @@ def main():
     
     # Setup MQTT client
     print("Connecting to MQTT broker...")
-    client = mqtt.Client(str(uuid.uuid1()))
+    # Stable id per device, so a reconnect replaces its old connection on the broker
+    client_id = f"mixing_bowl-{mac_address.replace(':', '')}"
+    client = mqtt.Client(client_id)
     # Remove TLS for non-encrypted connection
     # client.tls_set(cert_reqs=ssl.CERT_NONE)
     client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
@@ -351,6 +291,10 @@ def main():
         exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
+
+    # Latest-value slot: the sensor loop overwrites, the publisher thread drains
+    publish_slot = Queue(maxsize=1)
+    threading.Thread(target=publish_worker, args=(client, publish_slot), daemon=True).start()
     
     print("\n" + "=" * 50)
     print("Streaming kitchen instrument data...")
@@ -358,39 +302,45 @@ def main():
     print("Press Ctrl+C to exit")
     print("=" * 50 + "\n")
     
-    last_publish_time = 0
+    utensil = 'mixing_bowl'
+
+    # mac/ip/utensil never change, so serialize that part of the payload once
+    payload_prefix = ('{"mac": %s, "ip": %s, "utensil": %s, "data": ' % (
+        json.dumps(mac_address), json.dumps(ip_address), json.dumps(utensil))).encode()
+
+    # Pace on a monotonic deadline: sample every SAMPLE_INTERVAL and
+    # publish on every TICKS_PER_PUBLISH-th sample
+    next_deadline = time.monotonic()
+    tick = 0
+
+    # Bind what the loop calls every tick to locals (fast local loads)
+    monotonic = time.monotonic
+    sleep = time.sleep
+    update = detector.update
+    read = read_joystick
+    center_x, center_y, min_radius_sq = CENTER_X, CENTER_Y, MIN_RADIUS_SQ
     
     # Main loop
     while True:
+        next_deadline += SAMPLE_INTERVAL
         try:
-            #! Get current time (don't call multiple times!!!!)
-            current_time = time.time()
-
-            # Read joystick values
-            x = myJoystick.horizontal
-            y = myJoystick.vertical
-            button = myJoystick.button
+            # Read joystick values (one I2C transaction)
+            x, y, button = read(myJoystick)
 
-            utensil = 'mixing_bowl'
 
             #? ----------------------------------------------------
             #? this is the detecting hit part, 
             #? if the joystick makes a full circle, we will return hit
             
-            # Update circle detector
-            hit, radius, speed_state = detector.update(x, y)
-            # Calculate progress percentage (0-100%)
-            progress = (abs(detector.accumulated_angle) / 360.0) * 100
-            
-            # Display status in terminal
-            if current_time - last_publish_time >= PUBLISH_INTERVAL:
-                status = "STIRRING" if detector.in_motion else "IDLE"
-                print(f"{status} [{speed_state}] | X:{x:4d} Y:{y:4d} | "
-                    f"Speed:{detector.current_speed:.1f} degree/s | "
-                    f"Progress:{progress:5.1f}% | Circles:{detector.circles_completed}")
-                
-                # last_publish_time = current_time
-                #! we will update last_publish_time after publishing to MQTT
+            # Cheap reject: resting at center and already idle, so update()
+            # would only repeat the idle reset
+            dx = x - center_x
+            dy = y - center_y
+            if dx*dx + dy*dy < min_radius_sq and not detector.in_motion:
+                hit, radius, speed_state = False, 0, "IDLE"
+            else:
+                # Update circle detector (every active tick, it needs each angle step)
+                hit, radius, speed_state = update(x, y)
             
             # time.sleep(0.05)  # 20Hz update rate
             #! don't sleep here, we will control the publishing rate later
@@ -399,47 +349,38 @@ def main():
             #? ----------------------------------------------------
 
             
-            # Publish to MQTT at specified interval
-            if current_time - last_publish_time >= PUBLISH_INTERVAL:
-                # Re-create compact payload for MQTT (without indentation)
-                mqtt_payload = json.dumps({
-                    'mac': mac_address,
-                    'ip': ip_address,
-                    'utensil': utensil,
-                    'data': {
-                        'x': x,
-                        'y': y,
-                        'speed': round(detector.current_speed, 1),  # send the speed 
-                        'radius': round(radius, 1),  # optional: send radius
-                    },
-                    # 'mixing': {
-                    #     'speed_state': speed_state,  # "IDLE", "SLOW", "MEDIUM", "FAST"
-                    #     'current_speed': round(detector.current_speed, 1),  # degrees/sec
-                    #     'circles': detector.circles_completed,
-                    #     'progress': round(progress, 1)
-                    # },
-                    'timestamp': int(current_time)
-                })
-                
-                # Publish to MQTT
-                result = client.publish(MQTT_TOPIC, mqtt_payload)
-                
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    # print(f"[OK] Streaming: RGB({r:3d}, {g:3d}, {b:3d}) | {mac_address[:17]} | rc:{result.rc} mid:{result.mid}")
-                    print(f"     Payload: {mqtt_payload}")
-                else:
-                    print(f"[ERROR] Publish failed: rc={result.rc}")
-                    if not client.is_connected():
-                        print("[ERROR] MQTT client disconnected! Attempting to reconnect...")
-                        try:
-                            client.reconnect()
-                        except Exception as e:
-                            print(f"[ERROR] Reconnect failed: {e}")
+            # Display status and publish to MQTT at specified interval
+            tick += 1
+            if tick >= TICKS_PER_PUBLISH:
+                tick = 0
+                # Calculate progress percentage (0-100%)
+                progress = (abs(detector.accumulated_angle) / FULL_CIRCLE) * 100
+
+                status = "STIRRING" if detector.in_motion else "IDLE"
+                print(f"{status} [{speed_state}] | X:{x:4d} Y:{y:4d} | "
+                    f"Speed:{detector.current_speed:.1f} degree/s | "
+                    f"Progress:{progress:5.1f}% | Circles:{detector.circles_completed}")
+
+                # Re-create compact payload for MQTT (without indentation):
+                # x, y, speed (degree/s), radius and the wall-clock timestamp
+                # 'mixing': {
+                #     'speed_state': speed_state,  # "IDLE", "SLOW", "MEDIUM", "FAST"
+                #     'current_speed': round(detector.current_speed, 1),  # degrees/sec
+                #     'circles': detector.circles_completed,
+                #     'progress': round(progress, 1)
+                # },
+                mqtt_payload = payload_prefix + DATA_TEMPLATE % (
+                    x, y, detector.current_speed, radius, int(time.time()))
                 
-                last_publish_time = current_time
+                # Hand off to the publisher thread
+                offer_latest(publish_slot, mqtt_payload)
             
-            # Small sleep to prevent CPU spinning (shorter than both intervals)
-            time.sleep(0.05)  # 20Hz main loop
+            # Sleep exactly until the next sample instead of a fixed delay
+            sleep_for = next_deadline - monotonic()
+            if sleep_for > 0:
+                sleep(sleep_for)
+            else:
+                next_deadline = monotonic()  # Overran; don't burst to catch up
             
         except Exception as e:
             print(f"Error in main loop: {e}")
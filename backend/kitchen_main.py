@@ -2,30 +2,93 @@
 Kitchen Rhythm Game - Main Application Entry Point
 Physical cooking utensils as rhythm game controllers via MQTT
 """
+
+# eventlet must patch the stdlib before anything else imports it
+try:
+    import eventlet
+    eventlet.monkey_patch()
+    EVENTLET_AVAILABLE = True
+except ImportError:
+    EVENTLET_AVAILABLE = False
+
 import time
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
 
-from flask import Flask, render_template
+from flask import Flask, render_template, request
 from flask_socketio import SocketIO, emit
 from collections import deque
 
+# Optional: faster JSON encoding for SocketIO packets
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 from config import *
-from mqtt_handler import start_mqtt_client
+from mqtt_handler import start_mqtt_client, format_messages, history_snapshot
 from audio_manager import close_audio
 from chart_manager import start_chart_playback
 from parser import parse_midi_to_rhythm
 
+
+class OrjsonWrapper:
+    """json-module stand-in for python-socketio (orjson returns bytes, socketio wants str)."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+
 # Flask/SocketIO setup
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'mqtt-viewer-2025'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# One cooperative event loop for all clients when eventlet is installed,
+# otherwise one OS thread per client
+socketio = SocketIO(app, cors_allowed_origins="*",
+                    async_mode='eventlet' if EVENTLET_AVAILABLE else 'threading',
+                    json=OrjsonWrapper if ORJSON_AVAILABLE else None)
 
 # Store recent messages for new clients
 recent_messages = deque(maxlen=MAX_MESSAGES)
 
+# History replay to a new client goes out in chunks of this many messages
+BACKFILL_CHUNK = 25
+
 # Store loaded chart data for restart functionality
 chart_data = None
 
 
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+def setup_logging():
+    """
+    Route log records through a queue to a background listener so the
+    game threads never block on stdout.
+    
+    Returns:
+        QueueListener: started listener (stop it on shutdown to flush)
+    """
+    log_queue = queue.Queue(-1)
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(message)s'))
+    listener = QueueListener(log_queue, console)
+
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+    listener.start()
+    return listener
+
+
 # ============================================================================
 # FLASK ROUTES & SOCKETIO HANDLERS
 # ============================================================================
@@ -36,12 +99,29 @@ def index():
     return render_template('kitchen.html')
 
 
+def replay_history(sid, messages):
+    """
+    Send a message history snapshot to one client in BACKFILL_CHUNK-sized
+    batches, yielding between them so other clients and handlers keep running.
+    
+    Args:
+        sid: SocketIO session id of the client to send to
+        messages: Snapshot list of recent messages
+    """
+    for i in range(0, len(messages), BACKFILL_CHUNK):
+        chunk = format_messages(messages[i:i + BACKFILL_CHUNK])
+        socketio.emit('mqtt_message_batch', chunk, to=sid)
+        socketio.sleep(0)
+
+
 @socketio.on('connect')
 def handle_connect():
     """Client connected - send recent message history."""
     print('Web client connected')
-    for msg in recent_messages:
-        emit('mqtt_message', msg)
+    history = history_snapshot()
+    if history:
+        # Snapshot now; format and send in the background so connect returns
+        socketio.start_background_task(replay_history, request.sid, history)
 
 
 @socketio.on('disconnect')
@@ -81,11 +161,14 @@ def handle_restart_chart():
 # ============================================================================
 
 if __name__ == '__main__':
+    log_listener = setup_logging()
+
     print("=" * 60)
     print("  Kitchen Rhythm Game - MQTT Viewer")
     print("=" * 60)
     print(f"  Viewer URL:  http://0.0.0.0:5002")
     print(f"  Monitoring:  {MQTT_TOPIC} on {MQTT_BROKER}")
+    print(f"  Async mode:  {socketio.async_mode}")
     print("=" * 60)
 
     # Load rhythm chart
@@ -110,4 +193,5 @@ if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5001, debug=False, allow_unsafe_werkzeug=True)
     
     # Cleanup
-    close_audio()
\ No newline at end of file
+    close_audio()
+    log_listener.stop()
\ No newline at end of file
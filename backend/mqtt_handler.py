@@ -3,32 +3,77 @@ MQTT Handler - Message receiving and processing
 """
 
 import paho.mqtt.client as mqtt
-from datetime import datetime
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+import os
+import time
+import socket
 import json
 import threading
+import logging
 import math
+from collections import deque
+
+# Optional: faster JSON parsing (falls back to the stdlib json module)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Optional: MessagePack payloads from publishers with USE_MSGPACK enabled
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+# First byte of a MessagePack map (fixmap 0x80-0x8f, map16, map32)
+MSGPACK_MAP_START = frozenset(range(0x80, 0x90)) | {0xde, 0xdf}
 
 from config import (MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, 
-                    MQTT_USERNAME, MQTT_PASSWORD, SOUND_RULES)
-from audio_manager import should_play, play_sound, stop_sound, playing_state
-from game_logic import check_note_hits, sound_rules_lock
+                    MQTT_USERNAME, MQTT_PASSWORD, MQTT_SESSION_EXPIRY,
+                    SOUND_RULES, SOUND_STOP_SAMPLES, EMIT_BATCH_INTERVAL)
+from audio_manager import play_sound, stop_sound, playing_state, sensor_frame
+from game_logic import check_note_hits
+
+log = logging.getLogger(__name__)
 
 # ============================================================================
 # MQTT CLIENT
 # ============================================================================
 
 mqtt_client = None
+# One random id per server process, reused if the client is recreated
+_CLIENT_ID = 'idd-backend-' + os.urandom(8).hex()
 _socketio = None
 _recent_messages = None
 
+# Messages handed from the paho network thread to the processing worker.
+# Bounded so a stalled worker drops the oldest readings instead of growing
+MSG_QUEUE_SIZE = 256
+_msg_queue = deque(maxlen=MSG_QUEUE_SIZE)
+_msg_event = threading.Event()
+_worker_thread = None
+
+# Last (sensor frame, rule) evaluated per utensil; the sound decision is a
+# pure function of these, so a repeat reading can skip it
+_last_sound_input = {}
+
+# Consecutive non-matching readings seen per utensil while its sound plays
+_off_counts = {}
+
+# Debug messages waiting for the next batched emit to browsers
+_emit_buffer = []
+_emit_lock = threading.Lock()
+_emit_task = None
+
 # ============================================================================
 # MIXING BOWL DIRECTION TRACKING
 # ============================================================================
 
-# Track last position for direction detection
-mixing_bowl_state = {
-    'direction': None  # Current direction based on x position
-}
+# Last direction seen, kept while the joystick sits exactly at center
+_last_direction = None
 
 CENTER_X = 519
 CENTER_Y = 517
@@ -39,43 +84,133 @@ def detect_mixing_direction(x, y):
     Left half = counterclockwise, Right half = clockwise
     Returns: 'clockwise', 'counterclockwise', or None
     """
-    global mixing_bowl_state
+    global _last_direction
+
+    # -1 left of center, 0 exactly at center (keep last direction), 1 right
+    side = (x > CENTER_X) - (x < CENTER_X)
+    _last_direction = ('counterclockwise', _last_direction, 'clockwise')[side + 1]
+    return _last_direction
+
+
+def _bytes_to_hex(obj):
+    """json.dumps default: show MessagePack bin fields as hex strings."""
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.hex()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+def _msgpack_to_text(raw):
+    """MessagePack payload as JSON text for the viewer; a hex dump if it won't convert."""
+    try:
+        return json.dumps(msgpack.unpackb(raw, raw=False), default=_bytes_to_hex)
+    except (ValueError, TypeError):
+        return raw.hex()
+
+
+def format_messages(messages):
+    """
+    Return browser-ready copies of debug messages, turning the raw ts_ns
+    capture time into epoch milliseconds (the browser formats it for display)
+    and the payload bytes into text (MessagePack payloads become JSON text).
+    Done per emitted batch so the MQTT path never converts or decodes.
     
-    # Determine direction based on which side of center
-    if x < CENTER_X:
-        # Left half = counterclockwise
-        mixing_bowl_state['direction'] = 'counterclockwise'
-        return 'counterclockwise'
-    elif x > CENTER_X:
-        # Right half = clockwise
-        mixing_bowl_state['direction'] = 'clockwise'
-        return 'clockwise'
-    else:
-        # Exactly at center
-        return mixing_bowl_state['direction']  # Keep last direction
+    Args:
+        messages: Iterable of message dicts built by process_message
+    """
+    out = []
+    for message in messages:
+        message = dict(message)
+        message['timestamp'] = message.pop('ts_ns') // 1_000_000
+        if message.pop('msgpack'):
+            message['payload'] = _msgpack_to_text(message['payload'])
+        else:
+            message['payload'] = message['payload'].decode('utf-8', errors='replace')
+        out.append(message)
+    return out
+
+
+def broadcast_to_web_client(message):
+    """Queue message for the next batched send to connected web clients."""
+    with _emit_lock:
+        _emit_buffer.append(message)
+
+
+def history_snapshot():
+    """
+    Copy of the message history for backfilling a newly connected client.
+    Taken under _emit_lock; the history only holds messages already handed
+    to a batch, so later batches don't repeat the backfill.
+    """
+    with _emit_lock:
+        return list(_recent_messages) if _recent_messages is not None else []
 
 
-def broadcast_to_web_client(message, topic):
-    """Send message to all connected web clients via WebSocket."""
-    if _recent_messages is not None:
-        _recent_messages.append(message)
-    if _socketio:
-        _socketio.emit(topic, message, namespace='/')
+def _emit_batches():
+    """Every EMIT_BATCH_INTERVAL, send the queued messages as one mqtt_message_batch."""
+    global _emit_buffer
+    while True:
+        _socketio.sleep(EMIT_BATCH_INTERVAL)
+        try:
+            # Record in history when the batch goes out, not on arrival, so a
+            # client backfilled from the history isn't sent these again
+            with _emit_lock:
+                if not _emit_buffer:
+                    continue
+                batch, _emit_buffer = _emit_buffer, []
+                if _recent_messages is not None:
+                    _recent_messages.extend(batch)
+                connected = bool(_socketio.server.eio.sockets)
+            # Skip encoding the packet when no browser is connected; the
+            # history still backfills clients that connect later. Emitted
+            # outside the lock so the MQTT worker never waits on a socket write
+            if connected:
+                _socketio.emit('mqtt_message_batch', format_messages(batch), namespace='/')
+        except Exception:
+            # Keep the task alive: one bad batch must not stop all later ones
+            log.exception('Error sending message batch')
 
 
-def on_connect(client, userdata, flags, rc):
-    """MQTT connection callback."""
+def on_connect(client, userdata, flags, rc, properties=None):
+    """MQTT connection callback (MQTT v5)."""
     if rc == 0:
         print(f'MQTT connected to {MQTT_BROKER}:{MQTT_PORT}')
-        client.subscribe(MQTT_TOPIC)
-        print(f'Subscribed to {MQTT_TOPIC}')
+        # Send small control packets (subscribe, acks, pings) immediately
+        sock = client.socket()
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # A resumed session still holds our subscription; only subscribe
+        # when the broker started a fresh one
+        if flags.get('session present'):
+            print(f'Session resumed, still subscribed to {MQTT_TOPIC}')
+        else:
+            client.subscribe(MQTT_TOPIC)
+            print(f'Subscribed to {MQTT_TOPIC}')
     else:
         print(f'MQTT connection failed: {rc}')
 
 
 def on_message(client, userdata, msg):
     """
-    MQTT message received - main game logic happens here.
+    MQTT message received. Runs on paho's network thread, so it only
+    queues the message for _message_worker and returns.
+    """
+    _msg_queue.append((msg.topic, msg.payload))
+    _msg_event.set()
+
+
+def _message_worker():
+    """Drain queued MQTT messages in arrival order."""
+    while True:
+        _msg_event.wait()
+        _msg_event.clear()
+        while _msg_queue:
+            topic, payload = _msg_queue.popleft()
+            process_message(topic, payload)
+
+
+def process_message(topic, raw_payload):
+    """
+    Process one MQTT message - main game logic happens here.
     
     Flow:
     1. Parse MQTT message
@@ -84,68 +219,92 @@ def on_message(client, userdata, msg):
     4. Check if sensor data hits any pending rhythm game notes
     """
     try:
-        # Parse payload as JSON
-        try:
-            payload = json.loads(msg.payload.decode('utf-8'))
-            payload_str = json.dumps(payload, indent=2)
-            is_json = True
-        except:
-            payload_str = msg.payload.decode('utf-8', errors='replace')
-            is_json = False
+        # Parse payload as JSON (orjson reads the bytes directly). Publishers
+        # send JSON objects, so anything not starting with '{' skips the parse
+        # (and the exception it would raise)
+        is_json = raw_payload[:1] == b'{'
+        is_msgpack = False
+        if is_json:
+            try:
+                if ORJSON_AVAILABLE:
+                    payload = orjson.loads(raw_payload)
+                else:
+                    payload = json.loads(raw_payload)  # accepts bytes directly
+            except ValueError:  # orjson.JSONDecodeError subclasses it too
+                is_json = False
+        elif MSGPACK_AVAILABLE and raw_payload and raw_payload[0] in MSGPACK_MAP_START:
+            try:
+                payload = msgpack.unpackb(raw_payload, raw=False)
+                # Browsers expect JSON text; format_messages converts these
+                is_msgpack = is_json = True
+            except ValueError:  # msgpack's unpack errors subclass it
+                pass
         
-        # Create message object for frontend debugging
+        # Create message object for frontend debugging (raw payload; the
+        # viewer pretty-prints it, so no re-serialization here)
         message = {
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
-            'topic': msg.topic,
-            'payload': payload_str,
+            'ts_ns': time.time_ns(),  # converted in format_messages at emit time
+            'topic': topic,
+            'payload': raw_payload,  # decoded in format_messages at emit time
+            'msgpack': is_msgpack,
             'is_json': is_json
         }
-        broadcast_to_web_client(message, 'mqtt_message')
+        broadcast_to_web_client(message)
 
         if not is_json:
             return
 
         # Extract utensil and sensor data
         utensil = payload.get('utensil', 'unknown')
-        sensor_data = payload.get('data', {})
+        data = payload.get('data', {})
+        direction = None
         
         # ====================================================================
         # MIXING BOWL: Detect rotation direction from x, y coordinates
         # ====================================================================
         if utensil == 'mixing_bowl':
-            x = sensor_data.get('x', CENTER_X)
-            y = sensor_data.get('y', CENTER_Y)
+            x = data.get('x', CENTER_X)
+            y = data.get('y', CENTER_Y)
             direction = detect_mixing_direction(x, y)
-            sensor_data['direction'] = direction
             # Debug: show direction and position
-            if direction:
-                side = "LEFT" if x < CENTER_X else "RIGHT"
-                # print(f"[MIXING BOWL] Direction: {direction}, side: {side}, x={x}")
+            # print(f"[MIXING BOWL] Direction: {direction}, x={x}")
+
+        # Parse once; sound and note checks below only read attributes
+        sensor_data = sensor_frame(data, direction)
         
         # ====================================================================
         # SOUND PLAYBACK: Check if sensor data triggers sound for this utensil
         # ====================================================================
-        with sound_rules_lock:
-            rule = SOUND_RULES.get(utensil)
-            if rule and rule['target_value'] is not None:
-                condition_met = should_play(
-                    utensil, 
-                    sensor_data, 
-                    rule['target_value'], 
-                    rule['threshold']
-                )
-                sound_file = rule['file']
+        # Rules are replaced whole by the chart loop, so one read is a
+        # consistent snapshot without a lock
+        rule = SOUND_RULES.get(utensil)
+        # Same reading under the same rule has nothing new to start or stop
+        sound_input = (sensor_data, rule)
+        if (rule and rule.target_value is not None
+                and _last_sound_input.get(utensil) != sound_input):
+            _last_sound_input[utensil] = sound_input
+            condition_met = rule.check(sensor_data)
+            is_playing = playing_state[utensil]
 
+            if condition_met:
+                _off_counts[utensil] = 0
                 # Start sound if condition just became true
-                if condition_met and not playing_state[utensil]:
+                if not is_playing:
                     loop = (utensil == 'pan')  # Pan sizzle loops, others are one-shots
-                    play_sound(utensil, sound_file, loop=loop)
-                    playing_state[utensil] = True
+                    # Only counts as playing if a sound actually started
+                    playing_state[utensil] = play_sound(utensil, rule, loop=loop)
 
-                # Stop sound if condition is no longer met
-                elif not condition_met and playing_state[utensil]:
+            # Stop sound once the condition has stayed unmet for a few readings
+            elif is_playing:
+                off_count = _off_counts.get(utensil, 0) + 1
+                if off_count >= SOUND_STOP_SAMPLES:
                     stop_sound(utensil)
                     playing_state[utensil] = False
+                    off_count = 0
+                else:
+                    # Still counting: a repeat of this reading must count too
+                    del _last_sound_input[utensil]
+                _off_counts[utensil] = off_count
 
         # ====================================================================
         # RHYTHM GAME: Check if this sensor reading hits any pending notes
@@ -154,7 +313,7 @@ def on_message(client, userdata, msg):
             check_note_hits(utensil, sensor_data, _socketio)
                 
     except Exception as e:
-        print(f'Error processing message: {e}')
+        log.warning('Error processing message: %s', e)
 
 
 def start_mqtt_client(socketio, recent_messages):
@@ -165,19 +324,31 @@ def start_mqtt_client(socketio, recent_messages):
         socketio: SocketIO instance for sending events to frontend
         recent_messages: Deque for storing recent messages
     """
-    global mqtt_client, _socketio, _recent_messages
+    global mqtt_client, _socketio, _recent_messages, _worker_thread, _emit_task
     
     _socketio = socketio
     _recent_messages = recent_messages
+
+    # Message processing runs here, off the paho network thread
+    if _worker_thread is None:
+        _worker_thread = threading.Thread(target=_message_worker, daemon=True)
+        _worker_thread.start()
+    if _emit_task is None:
+        _emit_task = socketio.start_background_task(_emit_batches)
     
     try:
-        import uuid
-        mqtt_client = mqtt.Client(str(uuid.uuid1()))
+        mqtt_client = mqtt.Client(_CLIENT_ID, protocol=mqtt.MQTTv5)
         mqtt_client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
         mqtt_client.on_connect = on_connect
         mqtt_client.on_message = on_message
-        
-        mqtt_client.connect(MQTT_BROKER, port=MQTT_PORT, keepalive=60)
+
+        # Clean start on the first connect only; automatic reconnects resume
+        # the session so the broker keeps the subscription in between
+        connect_props = Properties(PacketTypes.CONNECT)
+        connect_props.SessionExpiryInterval = MQTT_SESSION_EXPIRY
+        mqtt_client.connect(MQTT_BROKER, port=MQTT_PORT, keepalive=60,
+                            clean_start=mqtt.MQTT_CLEAN_START_FIRST_ONLY,
+                            properties=connect_props)
         mqtt_client.loop_start()
         
         print('MQTT client started successfully')
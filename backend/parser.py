@@ -1,5 +1,65 @@
 import os
 import json
+import heapq
+
+# Optional: faster JSON parsing/writing (falls back to the stdlib json module)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Optional: compact binary charts (used for output paths ending in .msgpack)
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+from config import target_code
+
+
+def _load_json(path):
+    """Read a JSON file, parsing the raw bytes with orjson when available."""
+    if ORJSON_AVAILABLE:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _load_chart(path):
+    """Read a saved chart, either MessagePack or JSON (told apart by the first byte)."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    # A MessagePack chart starts with a map header (fixmap, map16 or map32)
+    if MSGPACK_AVAILABLE and raw and (0x80 <= raw[0] <= 0x8f or raw[0] in (0xde, 0xdf)):
+        return msgpack.unpackb(raw, raw=False)
+    if ORJSON_AVAILABLE:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _save_chart(chart_data, path):
+    """Write a chart as MessagePack if path ends in .msgpack, else indented JSON."""
+    if path.endswith(".msgpack"):
+        if not MSGPACK_AVAILABLE:
+            raise RuntimeError("msgpack is not installed")
+        with open(path, "wb") as f:
+            f.write(msgpack.packb(chart_data, use_bin_type=True))
+        return
+    _dump_json(chart_data, path)
+
+
+def _dump_json(obj, path):
+    """Write obj as indented JSON, using orjson when available."""
+    if ORJSON_AVAILABLE:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+        return
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2)
+
 
 def parse_midi_to_rhythm(file_path, output_path="./rhythm_charts/rhythm_chart.json"):
     """Parse MIDI JSON into rhythm game events."""
@@ -15,15 +75,13 @@ def parse_midi_to_rhythm(file_path, output_path="./rhythm_charts/rhythm_chart.js
         return None
 
     try:
-        with open(file_path, "r") as f:
-            midi_data = json.load(f)
+        midi_data = _load_json(file_path)
     except Exception as e:
         print(f"[ERROR] Failed to load MIDI file: {e}")
         return None
 
     try:
-        with open(MAPPING_PATH, "r") as f:
-            mapping_data = json.load(f)
+        mapping_data = _load_json(MAPPING_PATH)
     except Exception as e:
         print(f"[ERROR] Failed to load mapping file: {e}")
         return None
@@ -31,8 +89,9 @@ def parse_midi_to_rhythm(file_path, output_path="./rhythm_charts/rhythm_chart.js
     # Extract BPM from header
     bpm = midi_data["header"]["tempos"][0]["bpm"]
     
-    # Collect all notes from all tracks as events
-    events = []
+    # Build each track's events, then merge the per-track lists by time
+    per_track = []
+    max_end = 0
     
     for track in midi_data["tracks"]:
         track_name = track["name"]
@@ -42,14 +101,17 @@ def parse_midi_to_rhythm(file_path, output_path="./rhythm_charts/rhythm_chart.js
         utensil = mapping_data[track_name]
         utensil_name = utensil["name"]
         utensil_targets = utensil["targets"]
-        print(utensil_targets)
-        
-        for note in track["notes"]:
-            # Create event for each note
-            note_name = note["name"]
-            curr_utensil_target = utensil_targets[note_name] if note_name in utensil_targets else None
-
-            event = {
+
+        # Resolve each note name's target once per track, not once per note.
+        # Normalize to str so pad IDs written as ints match the string targets
+        resolved = {}
+        for note_name, target in utensil_targets.items():
+            target = str(target) if target is not None else None
+            resolved[note_name] = (target, target_code(target))
+        unmapped = (None, None)
+
+        track_events = [
+            {
                 "time": note["time"],
                 "type": "note",
                 "track": track_name,
@@ -62,26 +124,36 @@ def parse_midi_to_rhythm(file_path, output_path="./rhythm_charts/rhythm_chart.js
                 "octave": note["octave"],
                 "velocity": note["velocity"],
                 "duration": note["duration"],
-                "target" : curr_utensil_target
+                "target" : target,
+                "target_code": code
             }
-            events.append(event)
+            for note in track["notes"]
+            for target, code in (resolved.get(note["name"], unmapped),)
+        ]
+
+        # MIDI tracks are normally already in time order; sorting an ordered
+        # list is a single linear pass, and keeps merge correct if one isn't
+        track_events.sort(key=lambda e: e["time"])
+        per_track.append(track_events)
+
+        if track_events:
+            max_end = max(max_end, max(e["time"] + e["duration"] for e in track_events))
     
-    # Sort events by time
-    events = sorted(events, key=lambda e: e["time"])
+    # Linear k-way merge instead of re-sorting everything (stable, like sorted())
+    events = list(heapq.merge(*per_track, key=lambda e: e["time"]))
     
     # Create rhythm chart data
     chart_data = {
         "bpm": bpm,
         "offset": 0.0,
-        "total_duration": max(e["time"] + e["duration"] for e in events) if events else 0,
+        "total_duration": max_end,
         "num_tracks": len(midi_data["tracks"]),
         "events": events
     }
     
     # Save to output file
     try:
-        with open(output_path, "w") as f:
-            json.dump(chart_data, f, indent=2)
+        _save_chart(chart_data, output_path)
         print(f"[SUCCESS] Rhythm chart saved to: {output_path}")
         print(f"[INFO] {len(events)} events loaded")
         print(f"[INFO] BPM: {bpm}")
@@ -101,8 +173,7 @@ def load_rhythm_chart(file_path="./rhythm_chart.json"):
         return None
 
     try:
-        with open(file_path, "r") as f:
-            chart = json.load(f)
+        chart = _load_chart(file_path)
     except Exception as e:
         print(f"[ERROR] Failed to load chart: {e}")
         return None
@@ -5,28 +5,46 @@ TJA to Kitchen Rhythm Game JSON Converter (Final Version)
 
 import json
 
+# Optional: faster JSON writing (falls back to the stdlib json module)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+NOTE_TO_MIDI = {
+    'C3': 48, 'D3': 50, 'E3': 52, 'F3': 53, 'G3': 55, 'A3': 57, 'B3': 59,
+    'C4': 60, 'D4': 62, 'E4': 64, 'F4': 65, 'G4': 67, 'A4': 69, 'B4': 71,
+    'C5': 72
+}
+
+# (midi, pitch, octave) per known note name, so notes don't re-slice names
+NOTE_META = {name: (midi, name[:-1], int(name[-1])) for name, midi in NOTE_TO_MIDI.items()}
+
 
 def parse_tja(tja_file):
     """read TJA file"""
     
     try:
-        encodings = ['utf-8', 'utf-8-sig', 'shift-jis', 'cp932']
-        lines = None
-        
-        for encoding in encodings:
-            try:
-                with open(tja_file, 'r', encoding=encoding) as f:
-                    lines = f.readlines()
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if lines is None:
-            raise Exception("Cannot read the file")
-        
+        # Read once, then try decodings on the bytes. utf-8-sig also reads
+        # plain UTF-8 and drops a BOM that would break the TITLE: match
+        with open(tja_file, 'rb') as f:
+            raw = f.read()
     except FileNotFoundError:
         print(f"[ERROR] cannot find the file: {tja_file}")
         return None
+
+    lines = None
+    for encoding in ('utf-8-sig', 'shift-jis', 'cp932'):
+        try:
+            lines = raw.decode(encoding).splitlines()
+            break
+        except UnicodeDecodeError:
+            continue
+
+    if lines is None:
+        raise Exception("Cannot read the file")
     
     # reading metadata
     metadata = {
@@ -160,15 +178,11 @@ def create_midi_json(tracks_data, title='My Song'):
     """Create a JSON file that conforms to the format of modified_song.json."""
     
     def add_midi_fields(note):
-        note_to_midi = {
-            'C3': 48, 'D3': 50, 'E3': 52, 'F3': 53, 'G3': 55, 'A3': 57, 'B3': 59,
-            'C4': 60, 'D4': 62, 'E4': 64, 'F4': 65, 'G4': 67, 'A4': 69, 'B4': 71,
-            'C5': 72
-        }
-        
-        midi_num = note_to_midi.get(note['name'], 60)
-        pitch = note['name'][:-1]
-        octave = int(note['name'][-1])
+        name = note['name']
+        meta = NOTE_META.get(name)
+        if meta is None:
+            meta = (60, name[:-1], int(name[-1]))
+        midi_num, pitch, octave = meta
         
         return {
             'midi': midi_num,
@@ -279,8 +293,13 @@ def convert_tja_to_json(tja_file, output_file):
     print(f"\n[3/3] Generating JSON file: {output_file}")
     midi_json = create_midi_json(tracks_data, title=tja_data['title'])
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(midi_json, f, indent=2, ensure_ascii=False)
+    if ORJSON_AVAILABLE:
+        # orjson writes UTF-8 without escaping, like ensure_ascii=False
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(midi_json, option=orjson.OPT_INDENT_2))
+    else:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(midi_json, f, indent=2, ensure_ascii=False)
     
     print(f"  ✓ Parsing Complete！")
     